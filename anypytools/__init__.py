@@ -12,6 +12,7 @@ if "FOR_DISABLE_CONSOLE_CTRL_HANDLER" not in os.environ:
 from anypytools import macro_commands
 from anypytools.abcutils import AnyPyProcess, execute_anybodycon
 from anypytools.macroutils import AnyMacro
+from anypytools.session import AnyBodySession
 from anypytools.tools import (
     ABOVE_NORMAL_PRIORITY_CLASS,
     BELOW_NORMAL_PRIORITY_CLASS,
@@ -28,6 +29,7 @@ __all__ = [
     "h5py_wrapper",
     "AnyPyProcess",
     "AnyMacro",
+    "AnyBodySession",
     "macro_commands",
     "print_versions",
     "execute_anybodycon",
@@ -10,7 +10,10 @@ import atexit
 import collections
 import copy
 import ctypes
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
 import pathlib
 import shelve
@@ -18,13 +21,14 @@ import sys
 import time
 import types
 import warnings
-from contextlib import suppress
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, suppress
 from pathlib import Path
 from queue import Queue
 import subprocess
 from tempfile import NamedTemporaryFile
-from threading import RLock, Thread
-from typing import Generator, List
+from threading import BoundedSemaphore, RLock, Thread
+from typing import Dict, Generator, List
 
 import numpy as np
 from rich import print
@@ -36,14 +40,21 @@ from rich.progress import (
     TimeRemainingColumn,
 )
 
-from .macroutils import AnyMacro, MacroCommand
+from .macroutils import AnyMacro, LoadValues, MacroCommand, SaveValues
 from .tools import (
     BELOW_NORMAL_PRIORITY_CLASS,
     ON_WINDOWS,
     AnyPyProcessOutput,
     AnyPyProcessOutputList,
+    AnyBodyConLogParser,
+    anybodycon_version,
     case_preserving_replace,
     get_anybodycon_path,
+    ERROR_PATTERN,
+    WARNING_PATTERN,
+    _load_parsed_logfile,
+    _parse_logfile_in_worker,
+    _substring_pattern,
     get_ncpu,
     getsubdirs,
     make_hash,
@@ -52,10 +63,14 @@ from .tools import (
     silentremove,
     winepath,
 )
+from .resultcache import ResultCache
+from .wineutils import WinePrefixPool, WineServer
 
 __all__ = [
     "execute_anybodycon",
     "AnyPyProcess",
+    "AdaptiveTimeout",
+    "CircuitBreaker",
     "Task",
 ]
 
@@ -75,6 +90,9 @@ else:
 _thread_lock = RLock()
 _KILLED_BY_ANYPYTOOLS = 10
 _TIMEDOUT_BY_ANYPYTOOLS = 11
+_STALLED_BY_ANYPYTOOLS = 12
+_ABORTED_BY_ANYPYTOOLS = 13
+_SKIPPED_BY_ANYPYTOOLS = 14
 _NO_LICENSES_AVAILABLE = -22
 _UNABLE_TO_ACQUIRE_LICENSE = 234  # May indicate wrong password
 
@@ -118,6 +136,228 @@ _global_subprocess_container = _SubProcessContainer()
 atexit.register(_global_subprocess_container.stop_all)
 
 
+def _process_tree_cpu_time(pid):
+    """Return the total CPU time (sec) used by a process and its children.
+
+    Returns None if the CPU time can not be determined. This requires the
+    optional ``psutil`` package.
+    """
+    try:
+        import psutil
+    except ImportError:
+        return None
+    try:
+        parent = psutil.Process(pid)
+        procs = [parent] + parent.children(recursive=True)
+    except psutil.Error:
+        return None
+    cpu_time = 0.0
+    for proc in procs:
+        with suppress(psutil.Error):
+            times = proc.cpu_times()
+            cpu_time += times.user + times.system
+    return cpu_time
+
+
+_psutil_warned = False
+
+
+def _warn_if_psutil_missing():
+    """Log a warning, once, if the stall check can not use the CPU time."""
+    global _psutil_warned
+    if _psutil_warned:
+        return
+    try:
+        import psutil  # noqa: F401
+    except ImportError:
+        _psutil_warned = True
+        logger.warning(
+            "stall_timeout is set but psutil is not installed. Processes are "
+            "killed if they write nothing to the log for stall_timeout seconds, "
+            "even if they are still busy. Install psutil to also check the CPU "
+            "usage (pip install anypytools[full])."
+        )
+
+
+class _StallWatchdog(object):
+    """Detect processes which have stopped writing to their log file.
+
+    A process is considered stalled when its log file has not grown for
+    `stall_timeout` seconds, and its CPU usage in the same period has been
+    below `cpu_threshold` (fraction of a single core). The CPU usage is
+    only checked if ``psutil`` is installed, and a warning is logged once
+    if it is not.
+    """
+
+    def __init__(self, logfile, pid, stall_timeout, cpu_threshold=0.02):
+        _warn_if_psutil_missing()
+        self.logfile = logfile
+        self.pid = pid
+        self.stall_timeout = stall_timeout
+        self.cpu_threshold = cpu_threshold
+        self._last_size = -1
+        self._reset(time.monotonic())
+
+    def _reset(self, now):
+        self._ref_time = now
+        self._ref_cpu = _process_tree_cpu_time(self.pid)
+
+    def check(self):
+        """Return an exit code if the process should be stopped."""
+        now = time.monotonic()
+        try:
+            size = os.path.getsize(self.logfile)
+        except OSError:
+            size = self._last_size
+        if size != self._last_size:
+            self._last_size = size
+            self._reset(now)
+            return None
+        if now - self._ref_time < self.stall_timeout:
+            return None
+        cpu = _process_tree_cpu_time(self.pid)
+        if cpu is not None and self._ref_cpu is not None:
+            usage = (cpu - self._ref_cpu) / (now - self._ref_time)
+            if usage > self.cpu_threshold:
+                # Still busy without writing output. Start a new window.
+                self._reset(now)
+                return None
+        return _STALLED_BY_ANYPYTOOLS
+
+
+class _LogFollower(object):
+    """Follow a growing log file and pass new lines on to consumers.
+
+    Consumers are objects with a ``feed(lines)`` method. If ``feed`` returns
+    True the process is stopped. Call `close` when the process has ended, to
+    pass the rest of the log on to the consumers.
+    """
+
+    #: Maximum number of bytes read from the log file at a time
+    chunk_size = 2**20
+
+    def __init__(self, logfile, consumers):
+        self.logfile = logfile
+        self.consumers = consumers
+        self._pos = 0
+        # Pieces of the last line, which has no line ending yet
+        self._partial = []
+
+    @staticmethod
+    def _split_lines(data):
+        text = data.decode("utf8", errors="backslashreplace")
+        return text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+
+    def iter_lines(self):
+        """Yield the complete lines added to the log file since last call.
+
+        The file is read in chunks of `chunk_size` bytes, and the lines of each
+        chunk are yielded as a list. The unfinished last line is kept as a list
+        of pieces, which are only joined when its line ending arrives.
+        """
+        try:
+            fh = open(self.logfile, "rb")
+        except OSError:
+            return
+        with fh:
+            fh.seek(self._pos)
+            for data in iter(lambda: fh.read(self.chunk_size), b""):
+                self._pos += len(data)
+                end = data.rfind(b"\n")
+                if end < 0:
+                    self._partial.append(data)
+                    continue
+                self._partial.append(data[:end])
+                data, self._partial = b"".join(self._partial), [data[end + 1 :]]
+                if data.endswith(b"\r"):
+                    data = data[:-1]
+                yield self._split_lines(data)
+
+    def _feed(self, lines):
+        stop = False
+        for consumer in self.consumers:
+            stop = consumer.feed(lines) or stop
+        return stop
+
+    def check(self):
+        """Return an exit code if the process should be stopped."""
+        stop = False
+        for lines in self.iter_lines():
+            stop = self._feed(lines) or stop
+        return _ABORTED_BY_ANYPYTOOLS if stop else None
+
+    def close(self):
+        """Pass the rest of the log, including a last unterminated line, to the consumers."""
+        for lines in self.iter_lines():
+            self._feed(lines)
+        data, self._partial = b"".join(self._partial), []
+        if data:
+            self._feed(self._split_lines(data))
+
+
+class _FatalErrorDetector(object):
+    """Log consumer which requests a stop on the first non-ignored error."""
+
+    def __init__(
+        self, errors_to_ignore=None, warnings_to_include=None, fatal_warnings=False
+    ):
+        self.errors_to_ignore = errors_to_ignore or []
+        self.warnings_to_include = warnings_to_include or []
+        self.fatal_warnings = fatal_warnings
+        self._ignore_pattern = _substring_pattern(tuple(self.errors_to_ignore))
+        self._include_pattern = _substring_pattern(tuple(self.warnings_to_include))
+        self.error = None
+
+    def _is_fatal(self, line):
+        if ERROR_PATTERN.match(line):
+            return not self._ignore_pattern.search(line)
+        if self.fatal_warnings and WARNING_PATTERN.match(line):
+            return bool(self._include_pattern.search(line)) and not (
+                self._ignore_pattern.search(line)
+            )
+        return False
+
+    def feed(self, lines):
+        if self.error is None:
+            self.error = next((l for l in lines if self._is_fatal(l)), None)
+        return self.error is not None
+
+
+class _LoadPhaseDetector(object):
+    """Log consumer which detects when the model of a task has been loaded.
+
+    The task is assumed to be loading from the start. The load phase ends
+    when AnyBody reports the end of the model loading, or when the next
+    macro command after the ``load`` command is echoed in the log.
+    """
+
+    _end_markers = ("## Loading finished", "Model loading skipped", "ERROR")
+
+    def __init__(self, on_loaded=None):
+        self.on_loaded = on_loaded
+        self.loading = True
+        self._macro_commands = 0
+
+    def done(self):
+        """Mark the load phase as finished."""
+        if self.loading:
+            self.loading = False
+            if self.on_loaded is not None:
+                self.on_loaded()
+
+    def feed(self, lines):
+        for line in lines:
+            if not self.loading:
+                break
+            if line.startswith("#### Macro command >"):
+                self._macro_commands += 1
+                if self._macro_commands > 1:
+                    self.done()
+            elif self._macro_commands and line.startswith(self._end_markers):
+                self.done()
+        return False
+
+
 def _progress_print(progress, content):
     previous = progress.console.is_jupyter
     progress.console.is_jupyter = False
@@ -137,6 +377,8 @@ def execute_anybodycon(
     folder=None,
     interactive_mode=False,
     subprocess_container=_global_subprocess_container,
+    stall_timeout=None,
+    log_consumers=None,
 ):
     """Launch a single AnyBodyConsole applicaiton.
 
@@ -176,6 +418,17 @@ def execute_anybodycon(
         crashdump enabled
     folder :
         the folder in which AnyBody is executed
+    stall_timeout : int, optional
+        If given, the process is killed when nothing has been written to the
+        logfile for `stall_timeout` seconds and the process has stopped using
+        CPU. The CPU check requires the ``psutil`` package (included in the
+        ``full`` extras). Without it a warning is logged, and a process which
+        writes nothing to the log for `stall_timeout` seconds is killed even
+        if it is still busy. (Defaults to None)
+    log_consumers : list, optional
+        Objects with a ``feed(lines)`` method, which are passed the new lines of
+        the logfile while the process runs. If ``feed()`` returns True the process
+        is stopped. (Defaults to None)
 
     Returns
     -------
@@ -187,6 +440,8 @@ def execute_anybodycon(
     if folder is None:
         folder = os.getcwd()
 
+    wineprefix = env.get("WINEPREFIX") if env else None
+
     if logfile is None:
         logfile = sys.stdout
         macro_name = "macro.anymcr"
@@ -244,7 +499,7 @@ def execute_anybodycon(
                 "wine",
                 str(anybodycon_path.resolve()),
                 "-m",
-                winepath(macrofile_path, "--windows"),
+                winepath(macrofile_path, "--windows", wineprefix),
                 "/deb",
                 str(debug_mode),
                 "/ni",
@@ -260,11 +515,11 @@ def execute_anybodycon(
             # ON Linux/Wine we use a bat file to redirect the output into a file on wine/windows
             # side. This prevents a bug with AnyBody starts it's builtin python.
             anybodycmd = (
-                f'@call "{winepath(anybodycon_path.resolve(), "--windows")}"'
-                f' -m "{winepath(macrofile_path, "--windows")}"'
+                f'@call "{winepath(anybodycon_path.resolve(), "--windows", wineprefix)}"'
+                f' -m "{winepath(macrofile_path, "--windows", wineprefix)}"'
                 f" -deb {str(debug_mode)}"
                 " -ni"
-                f' >> "{winepath(str(logfile.name), "--windows")}" 2>&1\n'
+                f' >> "{winepath(str(logfile.name), "--windows", wineprefix)}" 2>&1\n'
                 r"@exit /b %ERRORLEVEL%"
             )
             # Wine can have problems with arbitrary names. Create simple uniqe name for the file
@@ -279,11 +534,18 @@ def execute_anybodycon(
 
     proc = Popen(cmd, **kwargs)
 
+    monitors = []
+    logfile_name = getattr(logfile, "name", None)
+    if isinstance(logfile_name, str):
+        if stall_timeout:
+            monitors.append(_StallWatchdog(logfile_name, proc.pid, stall_timeout))
+        if log_consumers:
+            monitors.append(_LogFollower(logfile_name, log_consumers))
+
     retcode = None
     subprocess_container.add(proc.pid)
     try:
-        proc.wait(timeout=timeout)
-        retcode = ctypes.c_int32(proc.returncode).value
+        retcode = _wait_for_process(proc, timeout, monitors)
     except subprocess.TimeoutExpired:
         proc.kill()
         proc.communicate()
@@ -301,8 +563,21 @@ def execute_anybodycon(
         else:
             subprocess_container.remove(proc.pid)
 
+    if retcode and logfile is not sys.stdout:
+        # On Linux/Wine AnyBody appends to the log through its own file handle,
+        # so the messages must be written after its output
+        logfile.seek(0, os.SEEK_END)
     if retcode == _TIMEDOUT_BY_ANYPYTOOLS:
         logfile.write(f"\nERROR: AnyPyTools : Timeout after {int(timeout)} sec.")
+    elif retcode == _ABORTED_BY_ANYPYTOOLS:
+        logfile.write(
+            f"\n{anybodycon_path.name} was stopped by AnyPyTools after an error"
+        )
+    elif retcode == _STALLED_BY_ANYPYTOOLS:
+        logfile.write(
+            f"\nERROR: AnyPyTools : Process stalled. No output for "
+            f"{int(stall_timeout)} sec."
+        )
     elif retcode == _KILLED_BY_ANYPYTOOLS:
         logfile.write(f"\n{anybodycon_path.name} was interrupted by AnyPyTools")
     elif retcode == _NO_LICENSES_AVAILABLE:
@@ -321,12 +596,141 @@ def execute_anybodycon(
             f"\nERROR: AnyPyTools : {anybodycon_path.name} exited unexpectedly."
             f" Return code: {retcode}"
         )
+    followers = [m for m in monitors if isinstance(m, _LogFollower)]
+    if followers:
+        logfile.flush()
+        for follower in followers:
+            follower.close()
     if not keep_macrofile:
         for fname in macrofile_cleanup:
             silentremove(str(fname))
     return retcode
 
 
+def _wait_for_process(proc, timeout, monitors=(), poll_interval=1.0):
+    """Wait for the process to finish, while polling the monitors.
+
+    Monitors are objects with a ``check()`` method that returns an exit code
+    if the process should be stopped. Returns the exit code of the process.
+    Raises ``subprocess.TimeoutExpired`` if the process runs longer than `timeout`.
+    """
+    if not monitors:
+        proc.wait(timeout=timeout)
+        return ctypes.c_int32(proc.returncode).value
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        wait_time = poll_interval
+        if deadline is not None:
+            wait_time = max(0, min(poll_interval, deadline - time.monotonic()))
+        try:
+            proc.wait(timeout=wait_time)
+            return ctypes.c_int32(proc.returncode).value
+        except subprocess.TimeoutExpired:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise
+        for monitor in monitors:
+            retcode = monitor.check()
+            if retcode is not None:
+                proc.kill()
+                proc.communicate()
+                return retcode
+
+
+def _starts_with_load(macro):
+    """Return True if the first command of the macro is a load command."""
+    return bool(macro) and macro[0].strip().lower().startswith("load ")
+
+
+_TASK_BLOCK_MARK = "#### ANYPYTOOLS TASK BLOCK:"
+
+
+def _fuse_macros(macros, values_file):
+    """Combine macros which share the same load command into a single macro.
+
+    The model is loaded once and its values are saved to `values_file`. Each
+    macro then runs in its own block, which starts by printing a marker line
+    and restoring the saved values.
+    """
+    fused = [macros[0][0], SaveValues(values_file).get_macro(0)]
+    for i, macro in enumerate(macros):
+        fused.append(f'print "{_TASK_BLOCK_MARK} {i}"')
+        fused.append(LoadValues(values_file).get_macro(0))
+        fused.extend(cmd for cmd in macro[1:] if cmd.strip() != "exit")
+    return fused
+
+
+def _split_fused_log(raw, n_blocks):
+    """Split the log of a fused macro into the output of each block.
+
+    Returns the preamble (everything before the first block) and a list
+    with the output of each block. Blocks which never started are None.
+    """
+    lines = raw.splitlines(keepends=True)
+    blocks = [None] * n_blocks
+    current, start = None, 0
+    preamble = raw
+    for lineno, line in enumerate(lines):
+        if not line.strip().startswith(_TASK_BLOCK_MARK):
+            continue
+        try:
+            index = int(line.strip()[len(_TASK_BLOCK_MARK) :])
+        except ValueError:
+            continue
+        if not 0 <= index < n_blocks:
+            continue
+        if current is None:
+            preamble = "".join(lines[:lineno])
+        else:
+            blocks[current] = "".join(lines[start:lineno])
+        current, start = index, lineno + 1
+    if current is not None:
+        blocks[current] = "".join(lines[start:])
+    return preamble, blocks
+
+
+def _remove_lines(filename, ranges):
+    """Remove the line ranges (start, stop) from a text file."""
+    if not ranges:
+        return
+    ranges = iter(sorted(ranges))
+    start, stop = next(ranges, (None, None))
+    folder = os.path.dirname(os.path.abspath(filename))
+    with open(filename, encoding="utf8", errors="surrogateescape") as src:
+        with NamedTemporaryFile(
+            "w",
+            dir=folder,
+            suffix=".tmp",
+            delete=False,
+            encoding="utf8",
+            errors="surrogateescape",
+        ) as dst:
+            for lineno, line in enumerate(src):
+                while stop is not None and lineno >= stop:
+                    start, stop = next(ranges, (None, None))
+                if start is None or lineno < start:
+                    dst.write(line)
+    os.replace(dst.name, filename)
+
+
+def _is_completed(task):
+    """Return True for tasks which were already completed without errors."""
+    return bool(task.output) and not task.has_error() and task.processtime > 0
+
+
+def _load_key(task):
+    """Return the folder and load command of a task which starts with a load."""
+    if _is_completed(task) or not _starts_with_load(task.macro):
+        return None
+    return (task.folder, task.macro[0].strip())
+
+
+def _fusion_key(task):
+    """Return the key for grouping tasks which can be fused, or None."""
+    if task.logfile:
+        return None
+    return _load_key(task)
+
+
 class Task(object):
     """Class for storing processing jobs.
 
@@ -354,6 +758,7 @@ class Task(object):
         self.number = number
         self.logfile = logfile or ""
         self.processtime = 0
+        self.timeout = None
         self.retcode = None
         self.name = taskname
         if taskname:
@@ -380,6 +785,8 @@ class Task(object):
             out["task_processtime"] = self.processtime
             out["task_macro"] = self.macro
             out["task_logfile"] = self.logfile
+            if getattr(self, "timeout", None) is not None:
+                out["task_timeout"] = self.timeout
         return out
 
     @classmethod
@@ -397,6 +804,7 @@ class Task(object):
             logfile=task_output["task_logfile"],
         )
         task.processtime = task_output["task_processtime"]
+        task.timeout = task_output.get("task_timeout")
         task.output = task_output
         return task
 
@@ -431,6 +839,18 @@ class Task(object):
         return all(k in output_elem for k in keys)
 
 
+class _LoadCanary(Task):
+    """Task which only loads a model to check it before running a batch."""
+
+
+def _skip_task(task, reason):
+    """Mark a task as skipped without running it."""
+    task.output = AnyPyProcessOutput()
+    task.processtime = 0
+    task.retcode = _SKIPPED_BY_ANYPYTOOLS
+    task.add_error(f"ERROR: AnyPyTools : Skipped. {reason}")
+
+
 def _tasklist_summery(tasklist: List[Task]) -> str:
     out = ""
     unfinished_tasks = [t for t in tasklist if t.processtime <= 0]
@@ -462,6 +882,181 @@ def _task_summery(task: Task) -> str:
     return line
 
 
+class AdaptiveTimeout(object):
+    """Derive the timeout of each task from the runtimes of similar tasks.
+
+    Runtimes of successful tasks are recorded for each model, i.e. for each
+    task folder and ``load`` macro command (or the whole macro if there is no
+    load command). Once enough runtimes are recorded the timeout of a task
+    is set to a quantile of the runtimes times a safety factor, clipped to the
+    range ``[min_timeout, max_timeout]``.
+
+    Parameters
+    ----------
+    history_file : str, optional
+        JSON file where the recorded runtimes are stored between sessions.
+        (Defaults to None, in which case runtimes are only kept in memory)
+    quantile : float, optional
+        The quantile of the recorded runtimes to use. (Defaults to 0.99)
+    safety_factor : float, optional
+        Factor multiplied on the runtime quantile. (Defaults to 3)
+    min_timeout : float, optional
+        The smallest timeout which will be used. (Defaults to 60 seconds)
+    max_timeout : float, optional
+        The largest timeout which will be used. (Defaults to None, which uses
+        the ``timeout`` argument of the `AnyPyProcess`)
+    min_samples : int, optional
+        Number of recorded runtimes needed before the timeout is adapted.
+        (Defaults to 5)
+    max_samples : int, optional
+        Maximum number of runtimes kept for each model. (Defaults to 500)
+
+    Examples
+    --------
+    >>> timeouts = AdaptiveTimeout("runtimes.json", safety_factor=2)
+    >>> app = AnyPyProcess(adaptive_timeout=timeouts)
+
+    """
+
+    def __init__(
+        self,
+        history_file=None,
+        quantile=0.99,
+        safety_factor=3.0,
+        min_timeout=60,
+        max_timeout=None,
+        min_samples=5,
+        max_samples=500,
+    ):
+        self.history_file = history_file
+        self.quantile = quantile
+        self.safety_factor = safety_factor
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.runtimes = collections.defaultdict(list)
+        if history_file and os.path.isfile(history_file):
+            with open(history_file, encoding="utf8") as fh:
+                self.runtimes.update(json.load(fh))
+
+    @staticmethod
+    def key(task):
+        """Return the key which identifies similar tasks."""
+        for cmd in task.macro:
+            if cmd.strip().lower().startswith("load "):
+                return f"{task.folder}::{cmd.strip()}"
+        # execute_anybodycon appends "exit" to the macro of the task
+        macro = list(task.macro)
+        while macro and macro[-1].strip() == "exit":
+            macro.pop()
+        return hashlib.sha1("\n".join(macro).encode("utf8")).hexdigest()
+
+    def timeout(self, task, default):
+        """Return the timeout to use for the task."""
+        max_timeout = self.max_timeout or default
+        runtimes = self.runtimes.get(self.key(task), [])
+        if len(runtimes) < self.min_samples:
+            return max_timeout
+        timeout = self.safety_factor * np.quantile(runtimes, self.quantile)
+        return float(np.clip(timeout, self.min_timeout, max_timeout))
+
+    def record(self, task):
+        """Record the runtime of a successfully completed task."""
+        if task.has_error() or task.processtime <= 0:
+            return
+        with _thread_lock:
+            runtimes = self.runtimes[self.key(task)]
+            runtimes.append(task.processtime)
+            del runtimes[: -self.max_samples]
+
+    def save(self):
+        """Save the recorded runtimes to the history file."""
+        if not self.history_file:
+            return
+        with _thread_lock:
+            with open(self.history_file, "w", encoding="utf8") as fh:
+                json.dump(self.runtimes, fh)
+
+
+class CircuitBreaker(object):
+    """Stop dispatching new tasks when many tasks fail with the same error.
+
+    Failures are grouped by their signature, which is the first line of
+    the first error of the task. The breaker trips when more than
+    `max_failures` tasks have failed with the same signature, or when more than
+    a fraction `max_failure_rate` of the last `window` tasks have failed with the
+    same signature.
+
+    Parameters
+    ----------
+    max_failures : int, optional
+        Maximum number of tasks which may fail with the same error.
+        (Defaults to None, which disables the limit)
+    max_failure_rate : float, optional
+        Maximum fraction of the last `window` tasks which may fail with
+        the same error. (Defaults to 0.9)
+    window : int, optional
+        Number of recently completed tasks used for the failure rate.
+        (Defaults to 20)
+    kill_running : bool, optional
+        If True, tasks which are still running when the breaker trips are
+        killed. Otherwise they are allowed to finish. (Defaults to False)
+
+    Examples
+    --------
+    >>> breaker = CircuitBreaker(max_failures=50, max_failure_rate=0.5, window=100)
+    >>> app = AnyPyProcess(circuit_breaker=breaker)
+
+    """
+
+    def __init__(
+        self, max_failures=None, max_failure_rate=0.9, window=20, kill_running=False
+    ):
+        self.max_failures = max_failures
+        self.max_failure_rate = max_failure_rate
+        self.window = window
+        self.kill_running = kill_running
+        self.reset()
+
+    def reset(self):
+        """Forget all recorded tasks."""
+        self.failures = collections.Counter()
+        self.recent = collections.deque(maxlen=self.window)
+        self.reason = None
+
+    @property
+    def tripped(self):
+        """True if the breaker has tripped."""
+        return self.reason is not None
+
+    @staticmethod
+    def signature(task):
+        """Return the error signature of a task, or None if it did not fail."""
+        if not task.has_error():
+            return None
+        lines = str(task.output["ERROR"][0]).strip().splitlines()
+        return lines[0] if lines else ""
+
+    def record(self, task):
+        """Record a completed task. Returns True if the breaker has tripped."""
+        signature = self.signature(task)
+        self.recent.append(signature)
+        if signature is None or self.tripped:
+            return self.tripped
+        self.failures[signature] += 1
+        count = self.failures[signature]
+        if self.max_failures is not None and count > self.max_failures:
+            self.reason = f"{count} tasks failed with: {signature}"
+        elif self.max_failure_rate is not None and len(self.recent) == self.window:
+            count = self.recent.count(signature)
+            if count > self.max_failure_rate * self.window:
+                self.reason = (
+                    f"{count} of the last {self.window} tasks failed with: {signature}"
+                )
+        return self.tripped
+
+
 class AnyPyProcess(object):
     """
     Class for configuring batch process jobs of AnyBody models.
@@ -483,6 +1078,102 @@ class AnyPyProcess(object):
     timeout : int, optional
         Maximum time (i seconds) a model can run until it is terminated.
         Defaults to 3600 sec (1 hour).
+    stall_timeout : int, optional
+        If given, a task is killed when its log file has not received any output
+        for `stall_timeout` seconds and the AnyBody process has stopped using CPU.
+        This catches hung processes long before the `timeout` expires. The task
+        is marked with a "Process stalled" error. Checking the CPU usage requires
+        the optional ``psutil`` package (included in the ``full`` extras).
+        Without it a warning is logged once, and only the log output is
+        monitored, so a solver step which logs nothing for longer than
+        `stall_timeout` is killed even if it is still running. Choose a
+        `stall_timeout` longer than the slowest silent step in that case.
+        (Defaults to None)
+    adaptive_timeout : bool or AdaptiveTimeout, optional
+        If given, the timeout of each task is derived from the recorded runtimes
+        of previous tasks running the same model. The ``timeout`` argument is then
+        used as the upper limit. Pass an `AdaptiveTimeout` instance to configure
+        how the timeout is calculated, and to keep the runtime history between sessions.
+        The timeout used is recorded in the ``task_timeout`` output of each task.
+        (Defaults to None)
+    warm_sessions : bool or AnyBodySessionPool, optional
+        If True, tasks are run in a pool of long-lived AnyBody sessions
+        (`anypytools.session.AnyBodySessionPool`) instead of starting a new
+        process for each task. Sessions are grouped by the ``load`` command
+        which starts the macro, and tasks with the same ``load`` command reuse an
+        idle session which already has the model loaded. The model values are
+        reset between tasks. Sessions are kept alive between calls to
+        `start_macro`. Pass an `AnyBodySessionPool` instance to configure
+        the reset strategy and recycling of the sessions. Sessions can not be
+        combined with ``wine_prefixes``, ``stall_timeout`` or ``abort_on_error``.
+        On Linux the sessions talk to ``wine AnyBodyCon.exe`` directly through
+        pipes, without the bat file redirection used for normal tasks, so models
+        which use AnyBody's built-in Python (Python hooks) may not work.
+        (Defaults to False)
+    fuse_tasks : int, optional
+        If set, up to `fuse_tasks` tasks which start with the same ``load``
+        command (in the same folder) are run one after the other in a single
+        AnyBody process. The model is loaded once, and its values are saved and
+        restored before each task. The fused tasks share the console process and
+        its state, so anything a task changes which is not reset by restoring
+        the values (e.g. files written or state outside the model values)
+        carries over to the following tasks. The log is split back into the
+        output of each task. Tasks with an explicit log file are not fused.
+        ``abort_on_error`` is not applied to fused tasks, so an error in one
+        task does not stop the others. The process gets the sum of the timeouts
+        of its tasks (``timeout`` times the number of tasks, or the adaptive
+        timeout of each task). When it times out, the running task and the
+        tasks after it fail. Can not be combined with ``warm_sessions`` or
+        ``interactive_mode``. (Defaults to None, which runs each task in its
+        own process)
+    preflight : bool or str, optional
+        If set, a canary is run for each distinct ``load`` command (and folder)
+        before the remaining tasks are dispatched. If the canary fails with errors
+        (which are not in ``ignore_errors``), the other tasks loading the same
+        model are skipped, and reported as not processed with a reference to the
+        canary's log file. Use ``"task"`` (or True) to run the first task of each
+        group as the canary, or ``"load"`` to run a macro which only loads the
+        model. (Defaults to None)
+    circuit_breaker : bool or CircuitBreaker, optional
+        If given, no new tasks are started once too many tasks have failed with
+        the same error (e.g. more than 90% of the last 20 tasks). The remaining
+        tasks are skipped, and the reason is reported in the summary. Pass a
+        `CircuitBreaker` instance to configure the thresholds, and whether
+        running tasks are killed. (Defaults to None)
+    spawn_rate : float, optional
+        Maximum number of AnyBody processes started per second. This spreads
+        out the start of the first tasks, so they don't all load their models at
+        the same time. (Defaults to None, which starts the processes as fast as
+        possible)
+    max_loading : int, optional
+        Maximum number of tasks which may be loading their model at the same
+        time. Model loading is limited by disk I/O and parsing, while the studies
+        are limited by the CPU. All `num_processes` worker slots are kept in use,
+        but a task waits before starting AnyBody until fewer than `max_loading`
+        tasks are in the load phase. The end of the load phase is detected from
+        the log output of the running tasks. The waiting time does not count
+        towards the timeout of the task. (Defaults to None, which does not limit
+        the loading)
+    result_cache : bool, str or ResultCache, optional
+        If given, the results of successful tasks are stored in a persistent
+        on-disk cache (`anypytools.resultcache.ResultCache`). Tasks are identified
+        by the macro, the AnyBody version and the content of the loaded model
+        files, and tasks found in the cache are not run again. Pass True to use
+        the default cache folder, a folder name, or a `ResultCache` instance.
+        Data files read by the model (e.g. ``AnyInputFile`` or C3D files) are
+        only part of the key if they are listed in the ``dependencies`` of the
+        `ResultCache`. Tasks found in the cache are not run, so files which the
+        macro would have written are not created. (Defaults to None)
+    lazy_parsing : bool, optional
+        If True, dumped arrays are kept as text in the output and only converted
+        to NumPy arrays when they are first accessed. This saves time and memory
+        when many variables are dumped, but only a few of them are used.
+        (Defaults to False)
+    abort_on_error : bool, optional
+        If True, the log file of each task is monitored while AnyBody runs, and the
+        process is stopped as soon as an error (which is not in ``ignore_errors``)
+        is written to the log. This saves time for failing models which continue
+        running later macro commands. (Defaults to False)
     silent : bool, optional
         Set to True to suppress any output such as progress bar and error
         messages. (Defaults to False).
@@ -499,6 +1190,24 @@ class AnyPyProcess(object):
     keep_logfiles : bool, optional
         If True logfile will never be removed. Even if a simulations successeds
         without error. (Defautls to False)
+    keep : list of str, optional
+        Names or glob patterns (e.g. ``"Main.Study.Output.*"``) of the dumped
+        variables to include in the output. The names are matched after the
+        renaming done by the ``Export`` macro. Other dumped variables are skipped
+        without being parsed. (Defaults to None, which includes all variables)
+    trim_logfiles : bool, optional
+        If True, the dumped variables which are not in ``keep`` are removed from
+        the log files which are kept after the run. (Defaults to False)
+    parse_processes : int, optional
+        Number of worker processes used to parse the log files. The log of each
+        task is then parsed in a separate process when the task ends, instead of
+        in the thread which runs the task, so parsing many large logs does not
+        hold up the other threads and the progress display. The arrays are sent
+        back through shared memory. The worker processes are started with the
+        ``spawn`` method, which imports the main module in each worker. Scripts
+        which use this option must therefore guard their top-level code with
+        ``if __name__ == "__main__":``. (Defaults to None, which parses the log
+        in the task thread while AnyBody runs)
     logfile_prefix : str, optional
         String which will be prefixed to the generated log files. This can be used
         to assign a more meaningfull name to a batch of logfiles.
@@ -521,6 +1230,20 @@ class AnyPyProcess(object):
         ``anypytools.IDLE_PRIORITY_CLASS``, ``anypytools.BELOW_NORMAL_PRIORITY_CLASS``,
         ``anypytools.NORMAL_PRIORITY_CLASS``, ``anypytools.HIGH_PRIORITY_CLASS``
         Default is BELOW_NORMAL_PRIORITY_CLASS.
+    persistent_wineserver : bool, optional
+        Only used on Linux/Wine. If True the ``wineserver`` of the Wine prefix is
+        started (and waited for) before the tasks are dispatched. The server keeps
+        running for a while after the last task, so tasks which are spread out in
+        time do not each pay for the Wine prefix startup. It then exits by itself,
+        and is never killed, since other processes may share it.
+        (Defaults to False)
+    wine_prefixes : int or list of str, optional
+        Only used on Linux/Wine. Spread the tasks over several Wine prefixes
+        to avoid that a single wineserver becomes a bottleneck when running
+        many tasks in parallel. Either the number of prefixes to use or a list of
+        prefix folders. Missing prefixes are created once as copies of the
+        current ``WINEPREFIX``. Worker slots are assigned to the prefixes
+        round-robin. (Defaults to None, which uses only the current prefix)
 
 
     Returns
@@ -559,6 +1282,22 @@ class AnyPyProcess(object):
         use_gui=False,
         priority=BELOW_NORMAL_PRIORITY_CLASS,
         interactive_mode=False,
+        persistent_wineserver=False,
+        wine_prefixes=None,
+        stall_timeout=None,
+        abort_on_error=False,
+        adaptive_timeout=None,
+        warm_sessions=False,
+        fuse_tasks=None,
+        preflight=None,
+        circuit_breaker=None,
+        spawn_rate=None,
+        max_loading=None,
+        result_cache=None,
+        lazy_parsing=False,
+        keep=None,
+        trim_logfiles=False,
+        parse_processes=None,
         **kwargs,
     ):
         if return_task_info is not None:
@@ -594,6 +1333,27 @@ class AnyPyProcess(object):
         self.priority = priority
         self.silent = silent
         self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self.abort_on_error = abort_on_error
+        if adaptive_timeout is True:
+            adaptive_timeout = AdaptiveTimeout()
+        self.adaptive_timeout = adaptive_timeout or None
+        if circuit_breaker is True:
+            circuit_breaker = CircuitBreaker()
+        self.circuit_breaker = circuit_breaker or None
+        self.spawn_rate = spawn_rate
+        self.max_loading = max_loading
+        self._load_semaphore = BoundedSemaphore(max_loading) if max_loading else None
+        if result_cache is True:
+            result_cache = ResultCache()
+        elif isinstance(result_cache, (str, os.PathLike)):
+            result_cache = ResultCache(result_cache)
+        self.result_cache = result_cache or None
+        self.lazy_parsing = lazy_parsing
+        self.keep = [keep] if isinstance(keep, str) else keep
+        self.trim_logfiles = trim_logfiles
+        self.parse_processes = parse_processes
+        self._parse_pool = None
         self.counter = 0
         self.debug_mode = debug_mode
         self.fatal_warnings = fatal_warnings
@@ -602,6 +1362,10 @@ class AnyPyProcess(object):
         self.keep_logfiles = keep_logfiles
         self.logfile_prefix = logfile_prefix
         self.interactive_mode = interactive_mode
+        self.persistent_wineserver = persistent_wineserver
+        self._wine_prefix_pool = None
+        if wine_prefixes is not None and not ON_WINDOWS:
+            self._wine_prefix_pool = WinePrefixPool(wine_prefixes)
         self.cached_arg_hash = None
         self.cached_tasklist = None
         if python_env is not None:
@@ -613,6 +1377,43 @@ class AnyPyProcess(object):
             self.env = env
         else:
             self.env = None
+        if warm_sessions and (use_gui or interactive_mode):
+            raise ValueError("warm_sessions can not be used with the AnyBody GUI")
+        if warm_sessions is True:
+            from .session import AnyBodySessionPool
+
+            warm_sessions = AnyBodySessionPool(
+                max_sessions=num_processes,
+                anybodycon_path=self.anybodycon_path,
+                env=self.env,
+                priority=priority,
+                debug_mode=debug_mode,
+            )
+        self.session_pool = warm_sessions or None
+        if self.session_pool is not None:
+            unsupported = [
+                name
+                for name, value in [
+                    ("wine_prefixes", self._wine_prefix_pool),
+                    ("stall_timeout", stall_timeout),
+                    ("abort_on_error", abort_on_error),
+                ]
+                if value
+            ]
+            if unsupported:
+                raise ValueError(
+                    "warm_sessions can not be used with " + ", ".join(unsupported)
+                )
+        if fuse_tasks is not None and (self.session_pool or interactive_mode):
+            raise ValueError(
+                "fuse_tasks can not be used with warm_sessions or interactive_mode"
+            )
+        self.fuse_tasks = fuse_tasks
+        if preflight is True:
+            preflight = "task"
+        if preflight not in (None, False, "task", "load"):
+            raise ValueError('preflight must be one of: None, True, "task" or "load"')
+        self.preflight = preflight or None
 
         self._local_subprocess_container = _SubProcessContainer()
         logging.debug("\nAnyPyProcess initialized")
@@ -853,6 +1654,99 @@ class AnyPyProcess(object):
             raise ValueError("Nothing to process for " + str(macrolist))
 
         # Start the scheduler
+        with ExitStack() as stack:
+            if self._wine_prefix_pool is not None:
+                self._wine_prefix_pool.create()
+                wineservers = self._wine_prefix_pool.servers(self.env)
+            else:
+                wineservers = [WineServer(env=self.env)]
+            if self.persistent_wineserver and not ON_WINDOWS:
+                for wineserver in wineservers:
+                    stack.enter_context(wineserver)
+            if self.parse_processes:
+                # Worker processes are started from the task threads, where
+                # forking is not safe
+                self._parse_pool = stack.enter_context(
+                    ProcessPoolExecutor(
+                        self.parse_processes,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+                )
+                stack.callback(setattr, self, "_parse_pool", None)
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.reset()
+            cache_keys = self._load_cached_results(tasklist)
+            try:
+                self._run_tasklist(tasklist)
+            finally:
+                if self.adaptive_timeout is not None:
+                    self.adaptive_timeout.save()
+                self._store_cached_results(tasklist, cache_keys)
+
+        self.cleanup_logfiles(tasklist)
+        # Cache the processed tasklist for restarting later
+        self.cached_tasklist = tasklist
+        return AnyPyProcessOutputList(t.get_output() for t in tasklist)
+
+    def _load_cached_results(self, tasklist: List[Task]) -> Dict[int, str]:
+        """Restore the results of tasks found in the result cache.
+
+        Returns the cache keys of the tasks which must be run.
+        """
+        if self.result_cache is None or self.interactive_mode:
+            return {}
+        ams_version = anybodycon_version(self.anybodycon_path)
+        options = self._result_cache_options()
+        cache_keys = {}
+        for task in tasklist:
+            if _is_completed(task):
+                continue
+            key = self.result_cache.key(task, ams_version, options)
+            if key is None:
+                continue
+            entry = self.result_cache.get(key)
+            if entry is None:
+                cache_keys[id(task)] = key
+                continue
+            task.output = AnyPyProcessOutput(entry["output"])
+            task.processtime = entry["processtime"]
+            task.retcode = 0
+            task.logfile = ""
+        self.result_cache.save_index()
+        return cache_keys
+
+    def _result_cache_options(self):
+        """Return the settings which change the output of the tasks.
+
+        Only settings which differ from the defaults are included, so the
+        cache keys of runs with the default settings are unchanged.
+        """
+        options = {}
+        if self.keep is not None:
+            options["keep"] = self.keep
+        if self.ignore_errors:
+            options["ignore_errors"] = self.ignore_errors
+        if self.warnings_to_include:
+            options["warnings_to_include"] = self.warnings_to_include
+        if self.fatal_warnings:
+            options["fatal_warnings"] = self.fatal_warnings
+        return options or None
+
+    def _store_cached_results(self, tasklist: List[Task], cache_keys: Dict[int, str]):
+        """Store the results of successful tasks in the result cache."""
+        for task in tasklist:
+            key = cache_keys.get(id(task))
+            if key is None or not _is_completed(task):
+                continue
+            output = AnyPyProcessOutput(
+                (k, v) for k, v in task.output.items() if not k.startswith("task_")
+            )
+            self.result_cache.put(
+                key, {"output": output, "processtime": task.processtime}
+            )
+
+    def _run_tasklist(self, tasklist: List[Task]):
+        """Process the tasks while showing a progress bar."""
         with Progress(
             TextColumn("{task.description}"),
             BarColumn(),
@@ -863,7 +1757,19 @@ class AnyPyProcess(object):
         ) as progress:
             task_progress = progress.add_task("Processing tasks", total=len(tasklist))
             try:
-                for task in self._schedule_processes(tasklist):
+                if self.preflight:
+                    scheduler = self._schedule_with_preflight(tasklist)
+                else:
+                    scheduler = self._schedule_processes(tasklist)
+                reported_skips = set()
+                for task in scheduler:
+                    if task.retcode == _SKIPPED_BY_ANYPYTOOLS:
+                        # Only report once for all tasks skipped for the same reason
+                        reason = task.output["ERROR"][0]
+                        if reason in reported_skips:
+                            progress.update(task_progress, advance=1, refresh=True)
+                            continue
+                        reported_skips.add(reason)
                     if task.has_error() and not self.silent:
                         _progress_print(progress, _task_summery(task))
                         progress.update(task_progress, style="red", refresh=True)
@@ -874,15 +1780,22 @@ class AnyPyProcess(object):
             finally:
                 self._local_subprocess_container.stop_all()
                 if not self.silent:
+                    if (
+                        self.circuit_breaker is not None
+                        and self.circuit_breaker.tripped
+                    ):
+                        _progress_print(
+                            progress,
+                            "[red]Stopped starting new tasks: "
+                            f"{self.circuit_breaker.reason}[/red]",
+                        )
                     _progress_print(progress, _tasklist_summery(tasklist))
 
-        self.cleanup_logfiles(tasklist)
-        # Cache the processed tasklist for restarting later
-        self.cached_tasklist = tasklist
-        return AnyPyProcessOutputList(t.get_output() for t in tasklist)
-
-    def _worker(self, task, task_queue):
+    def _worker(self, task, task_queue, slot=0):
         """Handle processing of the tasks."""
+        if isinstance(task, list):
+            self._fused_worker(task, task_queue, slot)
+            return
         with _thread_lock:
             task.process_number = self.counter
             self.counter += 1
@@ -896,102 +1809,345 @@ class AnyPyProcess(object):
             raise (ValueError(f"The folder does not exists: {task.folder}"))
 
         try:
-            if not task.logfile:
-                # If no explicit log file was given use NamedTemporaryFile
-                # to create one
-                with NamedTemporaryFile(
-                    mode="w+",
-                    prefix=(self.logfile_prefix or task.name.lower()) + "_",
-                    suffix=".txt",
-                    dir=task.folder,
-                    delete=False,
-                ) as fh:
-                    task.logfile = fh.name
-            with open(
-                task.logfile, "w+", encoding="utf8", errors="backslashreplace"
-            ) as logfile:
-                logfile.write("########### MACRO #############\n")
-                logfile.write("\n".join(task.macro))
-                logfile.write("\n\n######### OUTPUT LOG ##########")
-                logfile.flush()
-                task.logfile = logfile.name
-                starttime = time.time()
-                exe_args = dict(
-                    macro=task.macro,
-                    logfile=logfile,
-                    anybodycon_path=self.anybodycon_path,
-                    timeout=self.timeout,
-                    keep_macrofile=False,
-                    env=self.env,
-                    priority=self.priority,
-                    debug_mode=self.debug_mode,
-                    folder=task.folder,
-                    interactive_mode=self.interactive_mode,
-                    subprocess_container=self._local_subprocess_container,
+            timeout = self.timeout
+            if self.adaptive_timeout is not None:
+                task.timeout = self.adaptive_timeout.timeout(task, self.timeout)
+                timeout = task.timeout
+            parser_options = dict(
+                errors_to_ignore=self.ignore_errors,
+                warnings_to_include=self.warnings_to_include,
+                fatal_warnings=self.fatal_warnings,
+                lazy=self.lazy_parsing,
+                keep=self.keep,
+            )
+            if self._parse_pool is not None:
+                self._run_task(task, slot, timeout, read_log=False)
+                future = self._parse_pool.submit(
+                    _parse_logfile_in_worker, task.logfile, parser_options
                 )
-                try:
-                    task.retcode = execute_anybodycon(**exe_args)
-                    if task.retcode == _KILLED_BY_ANYPYTOOLS:
-                        task.processtime = 0
-                    else:
-                        task.processtime = time.time() - starttime
-                except KeyboardInterrupt as e:
+                task.output, skipped_lines = _load_parsed_logfile(*future.result())
+            else:
+                # The log is parsed while AnyBody runs
+                parser = AnyBodyConLogParser(**parser_options)
+                log_consumers = self._log_consumers(task) + [parser]
+                self._run_task(task, slot, timeout, log_consumers, read_log=False)
+                task.output = parser.finish()
+                skipped_lines = parser.skipped_lines
+            if self.trim_logfiles and (self.keep_logfiles or task.has_error()):
+                _remove_lines(task.logfile, skipped_lines)
+            # Load only runs would skew the runtime history
+            if self.adaptive_timeout is not None and not isinstance(task, _LoadCanary):
+                self.adaptive_timeout.record(task)
+        finally:
+            if not self.keep_logfiles and not task.has_error():
+                silentremove(task.logfile)
+                task.logfile = ""
+            task_queue.put(task)
+
+    def _fused_worker(self, tasks, task_queue, slot=0):
+        """Run several tasks, which load the same model, in one AnyBody process."""
+        with _thread_lock:
+            for task in tasks:
+                task.process_number = self.counter
+                self.counter += 1
+        folder = tasks[0].folder
+        with NamedTemporaryFile(suffix=".anyset", dir=folder, delete=False) as fh:
+            values_file = fh.name
+        if not ON_WINDOWS:
+            prefix = None
+            if self._wine_prefix_pool is not None:
+                prefix = str(self._wine_prefix_pool[slot])
+            values_file_arg = winepath(values_file, "--windows", prefix)
+        else:
+            values_file_arg = values_file
+        fused = Task(
+            folder=folder,
+            macro=_fuse_macros([task.macro for task in tasks], values_file_arg),
+            taskname=tasks[0].name,
+            number=tasks[0].number,
+        )
+        timeout = self.timeout * len(tasks)
+        if self.adaptive_timeout is not None:
+            for task in tasks:
+                task.timeout = self.adaptive_timeout.timeout(task, self.timeout)
+            timeout = sum(task.timeout for task in tasks)
+        try:
+            # Errors in one block should not stop the other blocks.
+            readout = self._run_task(fused, slot, timeout, log_consumers=[])
+            preamble, blocks = _split_fused_log(readout, len(tasks))
+            n_started = sum(block is not None for block in blocks)
+            for i, (task, block) in enumerate(zip(tasks, blocks)):
+                task.logfile = fused.logfile
+                if block is None:
+                    block = (
+                        "\nERROR: AnyPyTools : The AnyBody process ended before"
+                        " the task was run.\n"
+                    )
                     task.processtime = 0
-                    raise e
-                finally:
-                    logfile.seek(0)
-                try:
-                    readout = logfile.read()
-                except Exception as e:
-                    print(logfile.name)
-                    raise e
+                else:
+                    task.processtime = fused.processtime / n_started
+                # Only the last block is affected by how the process ended
+                task.retcode = fused.retcode if i >= n_started - 1 else 0
                 task.output = parse_anybodycon_output(
-                    readout,
+                    preamble + block,
                     self.ignore_errors,
                     self.warnings_to_include,
                     fatal_warnings=self.fatal_warnings,
+                    lazy=self.lazy_parsing,
+                    keep=self.keep,
                 )
+                if self.adaptive_timeout is not None:
+                    self.adaptive_timeout.record(task)
         finally:
-            if not self.keep_logfiles and not task.has_error():
-                silentremove(task.logfile)
-                task.logfile = ""
-            task_queue.put(task)
+            silentremove(values_file)
+            if not self.keep_logfiles:
+                if not any(task.has_error() for task in tasks):
+                    silentremove(fused.logfile)
+                for task in tasks:
+                    if not task.has_error():
+                        task.logfile = ""
+            for task in tasks:
+                task_queue.put(task)
+
+    def _run_task(self, task, slot, timeout, log_consumers=None, read_log=True):
+        """Run the macro of a task and return the content of its log file.
+
+        Returns None if `read_log` is False.
+        """
+        if not task.logfile:
+            # If no explicit log file was given use NamedTemporaryFile
+            # to create one
+            with NamedTemporaryFile(
+                mode="w+",
+                prefix=(self.logfile_prefix or task.name.lower()) + "_",
+                suffix=".txt",
+                dir=task.folder,
+                delete=False,
+            ) as fh:
+                task.logfile = fh.name
+        with open(
+            task.logfile, "w+", encoding="utf8", errors="backslashreplace"
+        ) as logfile:
+            logfile.write("########### MACRO #############\n")
+            logfile.write("\n".join(task.macro))
+            logfile.write("\n\n######### OUTPUT LOG ##########")
+            logfile.flush()
+            task.logfile = logfile.name
+            anybodycon_path, env = self.anybodycon_path, self.env
+            if self._wine_prefix_pool is not None:
+                anybodycon_path = self._wine_prefix_pool.rebase(anybodycon_path, slot)
+                env = self._wine_prefix_pool.env(slot, self.env)
+            if log_consumers is None:
+                log_consumers = self._log_consumers(task)
+            use_session = self.session_pool is not None and _starts_with_load(
+                task.macro
+            )
+            load_detector = None
+            if self._load_semaphore is not None and not use_session:
+                if _starts_with_load(task.macro):
+                    # Wait for a free load slot before starting AnyBody
+                    self._load_semaphore.acquire()
+                    load_detector = _LoadPhaseDetector(self._load_semaphore.release)
+                    log_consumers = list(log_consumers) + [load_detector]
+            starttime = time.time()
+            exe_args = dict(
+                macro=task.macro,
+                logfile=logfile,
+                anybodycon_path=anybodycon_path,
+                timeout=timeout,
+                keep_macrofile=False,
+                env=env,
+                priority=self.priority,
+                debug_mode=self.debug_mode,
+                folder=task.folder,
+                interactive_mode=self.interactive_mode,
+                subprocess_container=self._local_subprocess_container,
+                stall_timeout=self.stall_timeout,
+                log_consumers=log_consumers,
+            )
+            try:
+                if use_session:
+                    task.retcode = self._run_in_session(task, logfile, timeout)
+                    if log_consumers:
+                        _LogFollower(task.logfile, log_consumers).close()
+                else:
+                    task.retcode = execute_anybodycon(**exe_args)
+                if task.retcode == _KILLED_BY_ANYPYTOOLS:
+                    task.processtime = 0
+                else:
+                    task.processtime = time.time() - starttime
+            except KeyboardInterrupt as e:
+                task.processtime = 0
+                raise e
+            finally:
+                if load_detector is not None:
+                    load_detector.done()
+                logfile.seek(0)
+            if not read_log:
+                return None
+            try:
+                return logfile.read()
+            except Exception as e:
+                print(logfile.name)
+                raise e
+
+    def _run_in_session(self, task, logfile, timeout):
+        """Run the task in a warm session and write the output to the logfile."""
+        from .session import AnyBodySessionError
+
+        retcode = 0
+        try:
+            lines = self.session_pool.run(task.folder, task.macro, timeout=timeout)
+        except AnyBodySessionError as e:
+            lines = [f"ERROR: AnyPyTools : {e}"]
+            retcode = 1
+        logfile.write("\n" + "\n".join(lines))
+        logfile.flush()
+        return retcode
+
+    def _log_consumers(self, task):
+        """Create the objects which follow the log while the task runs."""
+        consumers = []
+        if self.abort_on_error:
+            consumers.append(
+                _FatalErrorDetector(
+                    self.ignore_errors,
+                    self.warnings_to_include,
+                    fatal_warnings=self.fatal_warnings,
+                )
+            )
+        return consumers
+
+    def _schedule_with_preflight(
+        self, tasklist: List[Task]
+    ) -> Generator[Task, None, None]:
+        """Run a canary for each model before scheduling the remaining tasks."""
+        groups: Dict[tuple, List[Task]] = collections.OrderedDict()
+        for task in tasklist:
+            key = _load_key(task)
+            if key is not None:
+                groups.setdefault(key, []).append(task)
+        if self.preflight == "load":
+            canaries = {
+                key: _LoadCanary(
+                    folder=key[0],
+                    macro=[key[1]],
+                    taskname=f"preflight-{group[0].name}",
+                    number=group[0].number,
+                )
+                for key, group in groups.items()
+                if len(group) > 1
+            }
+        else:
+            canaries = {key: group[0] for key, group in groups.items()}
+        failed = {}
+        canary_keys = {id(canary): key for key, canary in canaries.items()}
+        for canary in self._schedule_processes(list(canaries.values())):
+            if canary.has_error():
+                failed[canary_keys[id(canary)]] = canary
+            if not isinstance(canary, _LoadCanary):
+                yield canary
+        remaining = []
+        for task in tasklist:
+            if id(task) in canary_keys:
+                continue
+            canary = failed.get(_load_key(task))
+            if canary is None:
+                remaining.append(task)
+                continue
+            _skip_task(
+                task,
+                f"The preflight task ({canary.name}) for the model failed: "
+                f"{canary.output['ERROR'][0]} (log file: {canary.logfile})",
+            )
+            yield task
+        yield from self._schedule_processes(remaining)
 
     def _schedule_processes(self, tasklist: List[Task]) -> Generator[Task, None, None]:
         # Make a shallow copy of the task list,
         # so we don't mess with the callers list.
         tasklist = copy.copy(tasklist)
+        if self.fuse_tasks and self.fuse_tasks > 1:
+            tasklist = self._group_fused_tasks(tasklist)
         use_threading = "ANPYTOOLS_DEBUG_NO_THREADING" not in os.environ
         task_queue: Queue = Queue()
-        threads: List[Thread] = []
+        threads: Dict[Thread, int] = {}
+        last_spawn = float("-inf")
         # run while there is still threads, tasks or stuff in the queue
         # to process
         while threads or tasklist or task_queue.qsize():
+            if tasklist and self.circuit_breaker and self.circuit_breaker.tripped:
+                yield from self._skip_remaining(tasklist)
+                tasklist = []
+                if self.circuit_breaker.kill_running:
+                    self._local_subprocess_container.stop_all()
             # if we aren't using all the processors AND there is still
             # data left to compute, then spawn another thread
-            if (len(threads) < self.num_processes) and tasklist:
+            if (
+                (len(threads) < self.num_processes)
+                and tasklist
+                and self._may_spawn(last_spawn)
+            ):
+                # Each running thread occupies a worker slot.
+                slot = min(set(range(self.num_processes)) - set(threads.values()))
+                last_spawn = time.monotonic()
                 if use_threading:
                     t = Thread(
-                        target=self._worker, args=tuple([tasklist.pop(0), task_queue])
+                        target=self._worker,
+                        args=tuple([tasklist.pop(0), task_queue, slot]),
                     )
                     t.daemon = True
                     t.start()
-                    threads.append(t)
+                    threads[t] = slot
                 else:
-                    self._worker(tasklist.pop(0), task_queue)
+                    self._worker(tasklist.pop(0), task_queue, slot)
             else:
                 # In the case that we have the maximum number
                 # of running threads or we run out tasks.
                 # Check if any of them are done
-                for thread in threads:
+                for thread in list(threads):
                     if not thread.is_alive():
-                        threads.remove(thread)
+                        del threads[thread]
             while task_queue.qsize():
                 task = task_queue.get()
+                if self.circuit_breaker and task.retcode != _SKIPPED_BY_ANYPYTOOLS:
+                    self.circuit_breaker.record(task)
                 yield task
 
             time.sleep(0.1)
 
+    def _may_spawn(self, last_spawn):
+        """Return True if the spawn rate allows a new task to start."""
+        if self.spawn_rate and time.monotonic() - last_spawn < 1.0 / self.spawn_rate:
+            return False
+        return True
+
+    def _skip_remaining(self, tasklist):
+        """Skip the tasks which were not started when the circuit breaker tripped."""
+        for item in tasklist:
+            for task in item if isinstance(item, list) else [item]:
+                if _is_completed(task):
+                    yield task
+                    continue
+                _skip_task(task, f"Batch stopped. {self.circuit_breaker.reason}")
+                yield task
+
+    def _group_fused_tasks(self, tasklist):
+        """Group the tasks which can be fused into lists of `fuse_tasks` tasks."""
+        grouped = []
+        groups: Dict[tuple, list] = {}
+        for task in tasklist:
+            key = _fusion_key(task)
+            if key is None:
+                grouped.append(task)
+                continue
+            if key not in groups or len(groups[key]) >= self.fuse_tasks:
+                groups[key] = []
+                grouped.append(groups[key])
+            groups[key].append(task)
+        # Groups with a single task are just run as normal tasks.
+        return [t[0] if isinstance(t, list) and len(t) == 1 else t for t in grouped]
+
     def cleanup_logfiles(self, tasklist):
         for task in tasklist:
             try:
@@ -1008,7 +2164,13 @@ class AnyPyProcess(object):
                 except OSError as e:
                     logger.debug(f"Could not remove: {macrofile} {e}")
 
+    def close_sessions(self):
+        """Close the warm AnyBody sessions kept by the object."""
+        if getattr(self, "session_pool", None) is not None:
+            self.session_pool.close()
+
     def __del__(self):
         """Destructor to clean up any remaining subprocesses."""
         if hasattr(self, "_local_subprocess_container"):
             self._local_subprocess_container.stop_all()
+        self.close_sessions()
@@ -0,0 +1,479 @@
+# -*- coding: utf-8 -*-
+"""
+Index of the files pulled into an AnyScript model by its include statements.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from threading import RLock
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("abt.anypytools")
+
+__all__ = ["IncludeIndex", "ModelDependencies", "parse_load_command"]
+
+_INDEX_VERSION = 1
+
+# Limit on the number of (file, defines) combinations visited in a scan
+_MAX_VISITS = 100000
+
+_COMMENT_PATTERN = re.compile(
+    r'//[^\n]*|/\*.*?\*/|("(?:[^"\\\n]|\\.)*")', flags=re.DOTALL
+)
+_DIRECTIVE_PATTERN = re.compile(
+    r"^[ \t]*#[ \t]*(?P<kind>includeonce|include|import|path|define|undef|"
+    r"ifdef|ifndef|if|elif|else|endif)\b(?P<args>[^\n]*)",
+    flags=re.MULTILINE,
+)
+_QUOTED_PATTERN = re.compile(r'"(?P<value>[^"]*)"')
+_PATH_CLASS_PATTERN = re.compile(r"<(?P<name>\w+)>")
+_LOAD_PATTERN = re.compile(r'^\s*load\s+"(?P<file>[^"]+)"', flags=re.IGNORECASE)
+_LOAD_OPTION_PATTERN = re.compile(
+    r'-(?P<opt>def|p)\s+(?P<name>\w+)=(?:---)?"(?P<value>(?:[^"\\]|\\.)*)"'
+)
+_TOKEN_PATTERN = re.compile(
+    r"\s*(?:(?P<number>\d+(?:\.\d*)?)|(?P<name>[A-Za-z_]\w*)|"
+    r"(?P<op>&&|\|\||==|!=|<=|>=|[-+*/%<>!()]))"
+)
+
+# Value of defines which are set in branches that could not be evaluated
+_UNKNOWN = object()
+
+# Binary operators of #if expressions by precedence, lowest first
+_BINARY_OPERATORS = [
+    {"||": lambda a, b: int(bool(a) or bool(b))},
+    {"&&": lambda a, b: int(bool(a) and bool(b))},
+    {"==": lambda a, b: int(a == b), "!=": lambda a, b: int(a != b)},
+    {
+        "<": lambda a, b: int(a < b),
+        ">": lambda a, b: int(a > b),
+        "<=": lambda a, b: int(a <= b),
+        ">=": lambda a, b: int(a >= b),
+    },
+    {"+": lambda a, b: a + b, "-": lambda a, b: a - b},
+    {
+        "*": lambda a, b: a * b,
+        # C integer division and remainder truncate towards zero
+        "/": lambda a, b: _c_divide(a, b),
+        "%": lambda a, b: a - b * _c_divide(a, b),
+    },
+]
+
+
+def _c_divide(a, b):
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+class _ExpressionParser(object):
+    """Evaluate the integer expression of an #if directive like the C preprocessor."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise ValueError("Unexpected end of expression")
+        self.pos += 1
+        return token
+
+    def parse(self):
+        value = self._binary(0)
+        if self._peek() is not None:
+            raise ValueError(f"Unexpected token: {self._peek()}")
+        return value
+
+    def _binary(self, level):
+        if level == len(_BINARY_OPERATORS):
+            return self._unary()
+        operators = _BINARY_OPERATORS[level]
+        value = self._binary(level + 1)
+        while self._peek() in operators:
+            operator = operators[self._next()]
+            value = operator(value, self._binary(level + 1))
+        return value
+
+    def _unary(self):
+        token = self._next()
+        if token == "!":
+            return int(not self._unary())
+        if token == "-":
+            return -self._unary()
+        if token == "+":
+            return self._unary()
+        if token == "(":
+            value = self._binary(0)
+            if self._next() != ")":
+                raise ValueError("Missing closing parenthesis")
+            return value
+        if isinstance(token, int):
+            return token
+        raise ValueError(f"Unexpected token: {token}")
+
+
+def _strip_comments(text):
+    return _COMMENT_PATTERN.sub(lambda m: m.group(1) or "", text)
+
+
+def _parse_directives(text):
+    """Return the preprocessor directives in an AnyScript file as a list."""
+    directives = []
+    for match in _DIRECTIVE_PATTERN.finditer(_strip_comments(text)):
+        kind, args = match.group("kind"), match.group("args").strip()
+        if kind in ("include", "includeonce", "import"):
+            quoted = _QUOTED_PATTERN.search(args)
+            if quoted:
+                directives.append(["include", quoted.group("value")])
+        elif kind == "path":
+            name, *value = args.split(None, 1)
+            quoted = _QUOTED_PATTERN.search(value[0]) if value else None
+            if quoted:
+                directives.append(["path", name, quoted.group("value")])
+        elif kind == "define" and args:
+            name, *value = args.split(None, 1)
+            directives.append(["define", name, value[0].strip() if value else ""])
+        else:
+            directives.append([kind, args])
+    return directives
+
+
+def parse_load_command(command):
+    """Return the file, defines and paths of an AnyBody ``load`` macro command.
+
+    Returns None if the command is not a load command.
+
+    Examples
+    --------
+    >>> parse_load_command('load "main.any" -def N_STEP="20" -p DATA=---"c:/data"')
+    ('main.any', {'N_STEP': '20'}, {'DATA': 'c:/data'})
+
+    """
+    match = _LOAD_PATTERN.match(command)
+    if match is None:
+        return None
+    defs, paths = {}, {}
+    for option in _LOAD_OPTION_PATTERN.finditer(command[match.end() :]):
+        value = re.sub(r"\\(.)", r"\1", option.group("value"))
+        if option.group("opt") == "def":
+            defs[option.group("name")] = value
+        else:
+            paths[option.group("name")] = value
+    return match.group("file"), defs, paths
+
+
+@dataclass
+class ModelDependencies:
+    """The files used by a model, and a combined digest of their content."""
+
+    main_file: Path
+    files: List[Path] = field(default_factory=list)
+    unresolved: List[str] = field(default_factory=list)
+    digest: str = ""
+
+
+class _Scan(object):
+    """State of a single dependency scan."""
+
+    def __init__(self, index, main_file, defs, paths):
+        self.index = index
+        self.defines = dict(defs)
+        self.paths = {k: str(v) for k, v in paths.items()}
+        self.paths.setdefault("ANYBODY_PATH_MAINFILEDIR", os.path.dirname(main_file))
+        self.files: Dict[str, str] = {}
+        self.unresolved: List[str] = []
+        self._visited = set()
+
+    def _resolve_path(self, name, current_dir):
+        """Return the absolute path of a file name used in `current_dir`."""
+        unknown = []
+
+        def substitute(match):
+            if match.group("name") == "ANYBODY_PATH_CURRENTFILEDIR":
+                return current_dir
+            if match.group("name") in self.paths:
+                return self.paths[match.group("name")]
+            unknown.append(match.group("name"))
+            return match.group(0)
+
+        for _ in range(10):
+            if "<" not in name:
+                break
+            new_name = _PATH_CLASS_PATTERN.sub(substitute, name)
+            if new_name == name or unknown:
+                break
+            name = new_name
+        if unknown:
+            return None
+        return os.path.normpath(os.path.join(current_dir, name))
+
+    def _value(self, name, depth=0):
+        value = self.defines.get(name, _UNKNOWN)
+        if value is _UNKNOWN or depth > 10:
+            return _UNKNOWN
+        value = str(value).strip().strip('"')
+        if re.fullmatch(r"\d+", value):
+            return int(value)
+        if re.fullmatch(r"[A-Za-z_]\w*", value):
+            return self._value(value, depth + 1)
+        return _UNKNOWN
+
+    def evaluate(self, expr):
+        """Evaluate an #if expression. Returns None if it can not be evaluated."""
+        expr = re.sub(
+            r"defined\s*\(?\s*(\w+)\s*\)?",
+            lambda m: "1" if m.group(1) in self.defines else "0",
+            expr,
+        )
+        tokens, pos = [], 0
+        while pos < len(expr):
+            if expr[pos:].strip() == "":
+                break
+            match = _TOKEN_PATTERN.match(expr, pos)
+            if match is None:
+                return None
+            pos = match.end()
+            if match.group("name"):
+                value = self._value(match.group("name"))
+                if value is _UNKNOWN:
+                    return None
+                tokens.append(value)
+            elif match.group("op"):
+                tokens.append(match.group("op"))
+            elif "." in match.group("number"):
+                # Only integer expressions are supported
+                return None
+            else:
+                tokens.append(int(match.group("number")))
+        try:
+            return bool(_ExpressionParser(tokens).parse())
+        except (ValueError, ZeroDivisionError, RecursionError):
+            return None
+
+    def _visit_key(self, path, entry):
+        """Return the file together with the defines and paths it depends on."""
+        defines, paths = set(), set()
+        for directive in entry["directives"]:
+            if directive[0] in ("if", "elif", "ifdef", "ifndef"):
+                defines.update(re.findall(r"[A-Za-z_]\w*", directive[1]))
+            elif directive[0] in ("include", "path"):
+                paths.update(_PATH_CLASS_PATTERN.findall(directive[-1]))
+        return (
+            path,
+            tuple((name, self._state(self.defines, name)) for name in sorted(defines)),
+            tuple((name, self._state(self.paths, name)) for name in sorted(paths)),
+        )
+
+    @staticmethod
+    def _state(values, name):
+        if name not in values:
+            return None
+        value = values[name]
+        return "<unknown>" if value is _UNKNOWN else ("=", value)
+
+    def visit(self, path):
+        """Visit a file and the files it includes.
+
+        A file is visited again when it is included with other values of the
+        defines and path classes it uses, since it may then include other files.
+        """
+        entry = self.index._entry(path)
+        if entry is None:
+            self.unresolved.append(path)
+            return
+        key = self._visit_key(path, entry)
+        if key in self._visited or len(self._visited) > _MAX_VISITS:
+            return
+        self._visited.add(key)
+        self.files[path] = entry["digest"]
+        current_dir = os.path.dirname(path)
+        # Stack of branch states: (active, any_branch_taken, unknown)
+        stack = []
+
+        def active():
+            return all(state[0] for state in stack)
+
+        def unknown():
+            return any(state[2] for state in stack)
+
+        for directive in entry["directives"]:
+            kind = directive[0]
+            if kind in ("if", "ifdef", "ifndef"):
+                if kind == "if":
+                    result = self.evaluate(directive[1])
+                elif directive[1] in self.defines:
+                    known = self.defines[directive[1]] is not _UNKNOWN
+                    result = (kind == "ifdef") if known else None
+                else:
+                    result = kind == "ifndef"
+                if result is None:
+                    stack.append([True, False, True])
+                else:
+                    stack.append([result, result, False])
+            elif kind == "elif" and stack:
+                state = stack[-1]
+                if state[2]:
+                    state[0] = True
+                elif state[1]:
+                    state[0] = False
+                else:
+                    result = self.evaluate(directive[1])
+                    if result is None:
+                        state[0], state[2] = True, True
+                    else:
+                        state[0] = state[1] = result
+            elif kind == "else" and stack:
+                state = stack[-1]
+                state[0] = state[2] or not state[1]
+            elif kind == "endif" and stack:
+                stack.pop()
+            elif not active():
+                continue
+            elif kind == "define":
+                self.defines[directive[1]] = _UNKNOWN if unknown() else directive[2]
+            elif kind == "undef":
+                self.defines.pop(directive[1], None)
+            elif kind == "path":
+                resolved = self._resolve_path(directive[2], current_dir)
+                if resolved is not None:
+                    self.paths[directive[1]] = resolved
+            elif kind == "include":
+                resolved = self._resolve_path(directive[1], current_dir)
+                if resolved is None:
+                    self.unresolved.append(directive[1])
+                else:
+                    self.visit(resolved)
+
+
+class IncludeIndex(object):
+    """Index of AnyScript files and the files they include.
+
+    The include statements of each file are parsed once and stored in an
+    index together with a digest of the file content. The index is keyed on
+    the modification time and size of the files, so scanning a model again
+    only needs to check the files on disk.
+
+    The scan resolves ``#include``, ``#import`` and ``#path`` statements,
+    path classes (e.g. ``<ANYBODY_PATH_AMMR>``) and ``#define`` statements.
+    Conditional ``#if``/``#ifdef`` branches are evaluated when possible.
+    Branches which can not be evaluated are all included, so the dependencies
+    are a superset of the files the model actually uses.
+
+    Parameters
+    ----------
+    index_file : str, optional
+        JSON file to keep the index between sessions.
+        (Defaults to None, which only keeps the index in memory)
+
+    Examples
+    --------
+    >>> index = IncludeIndex("include_index.json")
+    >>> deps = index.scan("main.any", defs={"BM_LEG_MODEL": "_LEG_MODEL_TLEM2_"},
+    ...                   paths={"ANYBODY_PATH_AMMR": "c:/ammr"})
+    >>> len(deps.files), deps.digest
+    (1385, '1c5e...')
+    >>> index.save()
+
+    """
+
+    def __init__(self, index_file=None):
+        self.index_file = index_file
+        self.entries: Dict[str, dict] = {}
+        self._modified = False
+        self._lock = RLock()
+        if index_file and os.path.isfile(index_file):
+            try:
+                with open(index_file, encoding="utf8") as fh:
+                    data = json.load(fh)
+                if data.get("version") == _INDEX_VERSION:
+                    self.entries = data["files"]
+            except (OSError, ValueError, KeyError) as e:
+                logger.debug(f"Could not read include index {index_file}: {e}")
+
+    def _entry(self, path) -> Optional[dict]:
+        """Return the index entry for a file, updating it if the file changed."""
+        key = path
+        try:
+            stat = os.stat(key)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self.entries.get(key)
+            if (
+                entry is not None
+                and entry["mtime_ns"] == stat.st_mtime_ns
+                and entry["size"] == stat.st_size
+            ):
+                return entry
+        try:
+            with open(key, "rb") as fh:
+                content = fh.read()
+        except OSError:
+            return None
+        entry = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "digest": hashlib.sha256(content).hexdigest(),
+            "directives": _parse_directives(content.decode("utf8", errors="replace")),
+        }
+        with self._lock:
+            self.entries[key] = entry
+            self._modified = True
+        return entry
+
+    def scan(self, main_file, defs=None, paths=None) -> ModelDependencies:
+        """Find the files used by a model.
+
+        Parameters
+        ----------
+        main_file : str
+            The main file of the model.
+        defs : dict, optional
+            Defines set when loading the model.
+        paths : dict, optional
+            Path classes set when loading the model.
+
+        Returns
+        -------
+        ModelDependencies
+            The files used by the model, the includes which could not be
+            resolved, and a digest of the content of all the files.
+        """
+        main_file = os.path.normpath(os.path.abspath(str(main_file)))
+        scan = _Scan(self, main_file, defs or {}, paths or {})
+        scan.visit(main_file)
+        sha = hashlib.sha256()
+        for digest in sorted(scan.files.values()):
+            sha.update(digest.encode("ascii"))
+        for name in sorted(set(scan.unresolved)):
+            sha.update(b"\0" + name.encode("utf8"))
+        return ModelDependencies(
+            main_file=Path(main_file),
+            files=[Path(f) for f in scan.files],
+            unresolved=sorted(set(scan.unresolved)),
+            digest=sha.hexdigest(),
+        )
+
+    def save(self):
+        """Save the index to the index file."""
+        if not self.index_file or not self._modified:
+            return
+        folder = os.path.dirname(os.path.abspath(self.index_file))
+        os.makedirs(folder, exist_ok=True)
+        with self._lock:
+            with NamedTemporaryFile(
+                "w", dir=folder, suffix=".tmp", delete=False, encoding="utf8"
+            ) as fh:
+                json.dump({"version": _INDEX_VERSION, "files": self.entries}, fh)
+            os.replace(fh.name, self.index_file)
+            self._modified = False
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for using AnyBody models in numerical optimization.
+"""
+
+import logging
+from copy import copy
+
+import numpy as np
+
+from .macroutils import AnyMacro, Load, SetValue
+
+logger = logging.getLogger("abt.anypytools")
+
+__all__ = ["finite_difference_jacobian", "AnyBodyObjective"]
+
+
+def _task_error(result):
+    return RuntimeError(
+        f"AnyBody task {result.get('task_name', '')} failed:\n"
+        + "\n".join(result["ERROR"])
+    )
+
+
+def _output_vector(result, outputs):
+    """Return the outputs of a task as a flat array."""
+    values = [np.asarray(result[name], dtype=float).ravel() for name in outputs]
+    return np.concatenate(values) if values else np.empty(0)
+
+
+def _collect_outputs(results, outputs):
+    """Return the outputs of each task as the rows of a 2D array."""
+    rows = []
+    for result in results:
+        if "ERROR" in result:
+            raise _task_error(result)
+        rows.append(_output_vector(result, outputs))
+    try:
+        return np.vstack(rows)
+    except ValueError:
+        raise ValueError("The outputs must have the same size for all tasks") from None
+
+
+def _macro_with_values(macro, variables, values):
+    """Return a copy of `macro` which sets the variables to `values`.
+
+    `values` has one row for each macro to create. Variables which are
+    part of the macro are replaced, others are inserted after the load command.
+    """
+    macro = copy(macro)
+    macro._list = list(macro)
+    macro.number_of_macros = len(values)
+    insert_at = next((i + 1 for i, cmd in enumerate(macro) if isinstance(cmd, Load)), 0)
+    for j, var in enumerate(variables):
+        command = SetValue(var.var, [float(v) for v in values[:, j]])
+        for i, cmd in enumerate(macro):
+            if cmd is var:
+                macro[i] = command
+                break
+        else:
+            macro.insert(insert_at, command)
+            insert_at += 1
+    return macro
+
+
+def finite_difference_jacobian(
+    app, macro, variables, outputs, steps=1e-6, scheme="forward", folder=None
+):
+    """Compute the Jacobian of model outputs with respect to model parameters.
+
+    All the perturbed macros are generated up front and run as a single batch
+    with `app`, so the evaluations run in parallel. For the forward scheme
+    ``n + 1`` macros are run, and ``2 n`` macros for the central scheme, where
+    ``n`` is the number of variables.
+
+    Parameters
+    ----------
+    app : AnyPyProcess
+        The AnyPyProcess instance used to run the macros.
+    macro : AnyMacro
+        The base macro. It should load the model, run the operations and dump
+        the outputs.
+    variables : list of SetValue
+        The parameters to differentiate with respect to. The value of each
+        `SetValue` is the point where the Jacobian is evaluated. If the `SetValue`
+        objects are part of `macro`, they are replaced in place. Otherwise, they
+        are inserted after the ``load`` command.
+    outputs : list of str
+        The names of the outputs to differentiate. Array outputs are
+        flattened and stacked.
+    steps : float or list of float, optional
+        The step size for each variable. (Defaults to 1e-6)
+    scheme : str, optional
+        Finite difference scheme. Either ``"forward"`` or ``"central"``.
+        (Defaults to "forward")
+    folder : str, optional
+        The folder where the macros are run. (Defaults to the current working
+        directory)
+
+    Returns
+    -------
+    numpy.ndarray
+        The Jacobian with one row for each (flattened) output value and one
+        column for each variable.
+
+    Examples
+    --------
+    >>> macro = AnyMacro(
+    ...     Load("model.main.any"),
+    ...     OperationRun("Main.Study.InverseDynamics"),
+    ...     Dump("Main.Study.Output.MaxMuscleActivity"),
+    ... )
+    >>> jac = finite_difference_jacobian(
+    ...     AnyPyProcess(),
+    ...     macro,
+    ...     [SetValue("Main.Model.Mass", 70.0), SetValue("Main.Model.Height", 1.8)],
+    ...     ["MaxMuscleActivity"],
+    ...     steps=[0.1, 0.001],
+    ...     scheme="central",
+    ... )
+
+    """
+    if scheme not in ("forward", "central"):
+        raise ValueError('scheme must be either "forward" or "central"')
+    if not isinstance(macro, AnyMacro):
+        macro = AnyMacro(macro)
+    n = len(variables)
+    x0 = np.array([np.asarray(var.value, dtype=float).item() for var in variables])
+    steps = np.broadcast_to(np.asarray(steps, dtype=float), (n,))
+    if np.any(steps == 0):
+        raise ValueError("The step sizes must be non-zero")
+    perturbations = np.diag(steps)
+    if scheme == "forward":
+        values = np.vstack([x0, x0 + perturbations])
+    else:
+        values = np.vstack([x0 + perturbations, x0 - perturbations])
+
+    macrolist = _macro_with_values(macro, variables, values).create_macros()
+    folderlist = [folder] if folder is not None else None
+    results = app.start_macro(macrolist, folderlist=folderlist)
+    f = _collect_outputs(results, outputs)
+
+    if scheme == "forward":
+        return ((f[1:] - f[0]) / steps[:, np.newaxis]).T
+    return ((f[:n] - f[n:]) / (2 * steps[:, np.newaxis])).T
+
+
+class AnyBodyObjective(object):
+    """Objective function for optimizing the parameters of an AnyBody model.
+
+    The object maps a parameter vector to ``Set Value`` commands, runs the
+    macro with AnyPyProcess, and returns the selected outputs. Results are
+    cached by the parameter vector (rounded to `decimals`), so repeated
+    evaluations of the same point do not run the model again. It can be
+    passed directly to ``scipy.optimize.minimize`` and similar functions.
+
+    Use `evaluate` to run a whole population of parameter vectors as one
+    parallel batch. For population based optimizers the object can be used
+    as the ``workers`` map function (e.g. in
+    ``scipy.optimize.differential_evolution``), which then evaluates each
+    generation as one batch.
+
+    Parameters
+    ----------
+    app : AnyPyProcess
+        The AnyPyProcess instance used to run the macros.
+    macro : AnyMacro
+        The base macro. It should load the model, run the operations and
+        dump the outputs.
+    variables : list of str or SetValue
+        The AnyScript variables set from the parameter vector. `SetValue`
+        objects which are part of `macro` are replaced in place, other variables
+        are set right after the ``load`` command.
+    outputs : str or list of str
+        The output(s) to return. With a single output name of size one, the
+        objective returns a float. Otherwise, it returns the flattened outputs
+        as an array.
+    folder : str, optional
+        The folder where the macros are run. (Defaults to the current working
+        directory)
+    decimals : int, optional
+        Number of decimals the parameters are rounded to for the cache.
+        (Defaults to 10)
+    failure_value : float, optional
+        Value returned for parameters where the model fails. For objectives
+        which return an array, an array filled with `failure_value` is returned,
+        with the shape of the successful evaluations or `output_shape`. Failed
+        evaluations are not cached, so the point is run again when it is
+        evaluated the next time. (Defaults to None, which raises a RuntimeError
+        when the model fails)
+    output_shape : tuple of int, optional
+        Shape of the array returned by the objective. Only used for the failure
+        value, when no evaluation has succeeded yet. (Defaults to None, which
+        returns a scalar `failure_value` until the shape is known)
+
+    Examples
+    --------
+    >>> macro = AnyMacro(
+    ...     Load("model.main.any"),
+    ...     OperationRun("Main.Study.InverseDynamics"),
+    ...     Dump("Main.Study.Output.MaxMuscleActivity"),
+    ... )
+    >>> objective = AnyBodyObjective(
+    ...     AnyPyProcess(silent=True),
+    ...     macro,
+    ...     ["Main.Model.Seat.Height", "Main.Model.Seat.Angle"],
+    ...     "MaxMuscleActivity",
+    ...     failure_value=np.inf,
+    ... )
+    >>> result = differential_evolution(
+    ...     objective, bounds=[(0.3, 0.6), (0, 20)], workers=objective.map, updating="deferred"
+    ... )
+
+    """
+
+    def __init__(
+        self,
+        app,
+        macro,
+        variables,
+        outputs,
+        folder=None,
+        decimals=10,
+        failure_value=None,
+        output_shape=None,
+    ):
+        self.app = app
+        self.macro = macro if isinstance(macro, AnyMacro) else AnyMacro(macro)
+        self.variables = [
+            var if isinstance(var, SetValue) else SetValue(var, 0.0)
+            for var in variables
+        ]
+        self._scalar_output = isinstance(outputs, str)
+        self.outputs = [outputs] if self._scalar_output else list(outputs)
+        self.folder = folder
+        self.decimals = decimals
+        self.failure_value = failure_value
+        self.output_shape = output_shape
+        # A successful output, used for the shape of the failure value
+        self._like = None
+        self.cache = {}
+        self.n_evaluations = 0
+
+    def _key(self, x):
+        x = np.asarray(x, dtype=float).ravel()
+        if x.size != len(self.variables):
+            raise ValueError(
+                f"Expected {len(self.variables)} parameters, got {x.size} parameters"
+            )
+        return tuple(np.round(x, self.decimals).tolist())
+
+    def _result(self, result):
+        if "ERROR" in result:
+            if self.failure_value is None:
+                raise _task_error(result)
+            return None
+        value = _output_vector(result, self.outputs)
+        if self._scalar_output and value.size == 1:
+            return float(value[0])
+        return value
+
+    def _failure(self):
+        if self._like is None:
+            if self.output_shape is None:
+                return self.failure_value
+            return np.full(self.output_shape, self.failure_value, dtype=float)
+        if np.isscalar(self._like):
+            return self.failure_value
+        return np.full_like(self._like, self.failure_value, dtype=float)
+
+    def evaluate(self, xs):
+        """Evaluate several parameter vectors in one parallel batch.
+
+        Parameters
+        ----------
+        xs : array_like
+            Parameter vectors with shape (number of points, number of variables).
+
+        Returns
+        -------
+        list
+            The objective value of each point.
+        """
+        keys = [self._key(x) for x in np.atleast_2d(np.asarray(xs, dtype=float))]
+        missing = list(dict.fromkeys(key for key in keys if key not in self.cache))
+        failed = set()
+        if missing:
+            macro = _macro_with_values(self.macro, self.variables, np.array(missing))
+            folderlist = [self.folder] if self.folder is not None else None
+            results = self.app.start_macro(macro.create_macros(), folderlist=folderlist)
+            self.n_evaluations += len(missing)
+            for key, result in zip(missing, results):
+                value = self._result(result)
+                if value is None:
+                    # Not cached, so transient failures are retried
+                    failed.add(key)
+                    continue
+                self.cache[key] = value
+                if self._like is None:
+                    self._like = value
+        return [self._failure() if key in failed else self.cache[key] for key in keys]
+
+    def __call__(self, x, *args):
+        return self.evaluate([x])[0]
+
+    def map(self, func, iterable):
+        """Map function for the ``workers`` argument of population based optimizers.
+
+        The points are evaluated as one batch first, and `func` (which wraps
+        the objective) is then called for each point, using the cached results.
+        """
+        xs = list(iterable)
+        if xs:
+            self.evaluate(xs)
+        return list(map(func, xs))
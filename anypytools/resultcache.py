@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of task results which persists between sessions.
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import pickle
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from threading import RLock
+
+from .includeindex import IncludeIndex, parse_load_command
+
+logger = logging.getLogger("abt.anypytools")
+
+__all__ = ["ResultCache", "stable_digest", "model_digest"]
+
+
+def stable_digest(obj):
+    """Return a digest of `obj` which is the same between interpreter sessions.
+
+    Unlike the built-in ``hash()``, the digest does not depend on the hash
+    randomization of Python. `obj` may be any nesting of lists, tuples, dicts,
+    strings and numbers.
+    """
+    text = json.dumps(obj, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(text.encode("utf8")).hexdigest()
+
+
+def model_digest(main_file, defs=None, paths=None, index=None):
+    """Return a digest of the content of a model and the files it includes.
+
+    The included files are found with `anypytools.includeindex.IncludeIndex`.
+    Includes which can not be resolved are part of the digest by their name only.
+
+    Parameters
+    ----------
+    main_file : str
+        The main file of the model.
+    defs : dict, optional
+        Defines set when loading the model.
+    paths : dict, optional
+        Path classes set when loading the model.
+    index : IncludeIndex, optional
+        The index used to find the included files.
+
+    Returns
+    -------
+    str or None
+        The digest, or None if the main file does not exist.
+    """
+    if not os.path.isfile(main_file):
+        return None
+    index = index if index is not None else IncludeIndex()
+    return index.scan(main_file, defs, paths).digest
+
+
+def _file_digest(path):
+    """Return a digest of the content of a file."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(2**20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def default_cache_dir():
+    """Return the default folder for the result cache."""
+    if "ANYPYTOOLS_CACHE_DIR" in os.environ:
+        return Path(os.environ["ANYPYTOOLS_CACHE_DIR"])
+    return Path.home() / ".cache" / "anypytools" / "results"
+
+
+class ResultCache(object):
+    """Content addressed on-disk cache of task results.
+
+    The results of successful tasks are stored under a key computed from the
+    macro, the version of the AnyBody Modeling System, and the content of the
+    loaded model files. Tasks which are unchanged are then not run again,
+    across sessions and users sharing the same cache folder. The least
+    recently used results are removed when the cache exceeds `max_size`.
+
+    Only the files reached through ``#include`` and ``#import`` statements
+    are part of the key. Data files which the model reads when it is loaded
+    or run (e.g. ``AnyInputFile``, C3D files or other ``FileName`` values)
+    must be listed in `dependencies`. Otherwise changes to them are not
+    detected, and stale results are returned. Tasks found in the cache are
+    not run, so files which the macro would have written (e.g. exported or
+    saved data) are not created.
+
+    Parameters
+    ----------
+    directory : str, optional
+        The cache folder. Defaults to the ``ANYPYTOOLS_CACHE_DIR`` environment
+        variable or ``~/.cache/anypytools/results``.
+    max_size : int, optional
+        Maximum size of the cache in bytes. (Defaults to 1 GB)
+    dependencies : list of str, optional
+        Other files used by the models, whose content is added to the key.
+        Relative paths and glob patterns (e.g. ``"data/*.c3d"``) are
+        relative to the folder of each task. (Defaults to None)
+
+    Examples
+    --------
+    >>> app = AnyPyProcess(result_cache=ResultCache("model_cache", max_size=100e6))
+    >>> results = app.start_macro(macrolist)
+    >>> results = app.start_macro(macrolist)  # Returns instantly
+
+    """
+
+    suffix = ".pickle"
+
+    def __init__(self, directory=None, max_size=2**30, dependencies=None):
+        self.directory = Path(directory) if directory else default_cache_dir()
+        self.max_size = max_size
+        self.dependencies = list(dependencies or [])
+        self._size = None
+        self._lock = RLock()
+        self.index = IncludeIndex(self.directory / "include_index.json")
+        self._unresolved_warned = set()
+
+    def key(self, task, ams_version="", options=None):
+        """Return the cache key for the task, or None if it can not be cached.
+
+        Tasks are not cached if some of the files included by the model can not
+        be found, e.g. because of unknown path classes. `options` are other
+        settings which change the result of the task.
+        """
+        if not task.macro:
+            return None
+        load = parse_load_command(task.macro[0])
+        if load is None:
+            return None
+        filename, defs, paths = load
+        main_file = os.path.join(task.folder, filename)
+        if not os.path.isfile(main_file):
+            return None
+        deps = self.index.scan(main_file, defs, paths)
+        if deps.unresolved:
+            # Changes to these files would not change the key
+            if main_file not in self._unresolved_warned:
+                self._unresolved_warned.add(main_file)
+                logger.warning(
+                    f"Results of {main_file} are not cached. Could not resolve "
+                    "the includes: " + ", ".join(deps.unresolved)
+                )
+            return None
+        parts = [list(task.macro), ams_version, deps.digest]
+        if self.dependencies:
+            parts.append(self._dependencies_digest(task.folder))
+        if options:
+            parts.append(options)
+        return stable_digest(parts)
+
+    def _dependencies_digest(self, folder):
+        """Return a digest of the files matched by `dependencies` in `folder`."""
+        digests = []
+        for pattern in self.dependencies:
+            paths = sorted(glob.glob(os.path.join(folder, pattern)))
+            files = [os.path.relpath(p, folder) for p in paths if os.path.isfile(p)]
+            digests.append(
+                [pattern, [[f, _file_digest(os.path.join(folder, f))] for f in files]]
+            )
+        return stable_digest(digests)
+
+    def save_index(self):
+        """Save the include index used for the model digests."""
+        self.index.save()
+
+    def _path(self, key):
+        return self.directory / key[:2] / (key + self.suffix)
+
+    def get(self, key):
+        """Return the cached entry for `key`, or None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fh:
+                entry = pickle.load(fh)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.debug(f"Could not read cache entry {path}: {e}")
+            return None
+        # Mark the entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, entry):
+        """Store an entry in the cache."""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as fh:
+            pickle.dump(entry, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(fh.name, path)
+        with self._lock:
+            if self._size is not None:
+                self._size += path.stat().st_size
+            if self.size > self.max_size:
+                self.evict()
+
+    def _entries(self):
+        if not self.directory.is_dir():
+            return []
+        entries = []
+        for path in self.directory.glob("*/*" + self.suffix):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    @property
+    def size(self):
+        """The total size of the cache in bytes."""
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            return self._size
+
+    def evict(self, max_size=None):
+        """Remove the least recently used entries until the cache is below `max_size`."""
+        max_size = self.max_size if max_size is None else max_size
+        with self._lock:
+            entries = sorted(self._entries())
+            size = sum(size for _, size, _ in entries)
+            for _, entry_size, path in entries:
+                if size <= max_size:
+                    break
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                size -= entry_size
+            self._size = size
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        self.evict(max_size=0)
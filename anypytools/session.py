@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+"""
+Long-lived interactive sessions with the AnyBody Console application.
+"""
+
+import collections
+import ctypes
+import logging
+import os
+import subprocess
+import time
+from contextlib import suppress
+from pathlib import Path
+from queue import Empty, Queue
+from tempfile import NamedTemporaryFile
+from threading import Condition, RLock, Thread
+
+from .abcutils import Popen, _global_subprocess_container, _starts_with_load
+from .macroutils import LoadValues, MacroCommand, SaveValues
+from .tools import (
+    BELOW_NORMAL_PRIORITY_CLASS,
+    ERROR_PATTERN,
+    ON_WINDOWS,
+    get_anybodycon_path,
+    parse_anybodycon_output,
+    silentremove,
+    winepath,
+)
+
+logger = logging.getLogger("abt.anypytools")
+
+__all__ = ["AnyBodySession", "AnyBodySessionError", "AnyBodySessionPool"]
+
+_SESSION_MARK = "#### ANYPYTOOLS SESSION MARK:"
+
+
+class AnyBodySessionError(RuntimeError):
+    """Raised when the AnyBody console process of a session fails."""
+
+
+def _macro_lines(macro):
+    """Convert macro input to a list of macro command lines."""
+    if isinstance(macro, (str, MacroCommand)):
+        macro = [macro]
+    lines = []
+    for cmd in macro:
+        if isinstance(cmd, MacroCommand):
+            cmd = cmd.get_macro(index=0)
+        lines.extend(line for line in cmd.splitlines() if line.strip())
+    return lines
+
+
+class AnyBodySession(object):
+    """Keep an AnyBody Console application running for repeated macro calls.
+
+    The console application is started in interactive mode, and macro
+    commands are sent to it over stdin. This avoids restarting AnyBody and
+    reloading the model for every evaluation, which is useful for
+    optimisers and UIs which only change a few values between runs.
+
+    The output of each call to `run` is framed by printing a marker after
+    the macro commands. The output is parsed with
+    `anypytools.tools.parse_anybodycon_output`.
+
+    Parameters
+    ----------
+    anybodycon_path : str, optional
+        Path to the AnyBodyConsole application. Defaults to the default
+        installed AnyBody installation.
+    folder : str, optional
+        The folder in which AnyBody is executed. Defaults to the current
+        working directory.
+    env : dict, optional
+        Environment varaibles which are passed to the AnyBody console.
+    priority : int, optional
+        The priority of the process. Default is BELOW_NORMAL_PRIORITY_CLASS.
+    debug_mode : int, optional
+        The AMS debug mode to use. Defaults to 0 which is disabled.
+    ignore_errors : list of str, optional
+        List of AnyBody Errors substrings to ignore. (Defaults to None)
+    warnings_to_include : list of str, optional
+        List of warning substrings to include in the output. (Defaults to None)
+    fatal_warnings: bool, optional
+        Treat warnings given by ``warnings_to_include`` as errors.
+    logfile : str, optional
+        If given, all output from the console application is also
+        appended to this file. (Defaults to None)
+
+    Examples
+    --------
+    >>> with AnyBodySession() as session:
+    ...     session.run('load "model.main.any"')
+    ...     for val in [1.0, 1.1, 1.2]:
+    ...         out = session.run([
+    ...             SetValue("Main.Model.Parameter", val),
+    ...             RunOperation("Main.Study.InverseDynamics"),
+    ...             Dump("Main.Study.Output.MaxMuscleActivity"),
+    ...         ])
+
+    """
+
+    def __init__(
+        self,
+        anybodycon_path=None,
+        folder=None,
+        env=None,
+        priority=BELOW_NORMAL_PRIORITY_CLASS,
+        debug_mode=0,
+        ignore_errors=None,
+        warnings_to_include=None,
+        fatal_warnings=False,
+        logfile=None,
+    ):
+        if anybodycon_path is None:
+            anybodycon_path = get_anybodycon_path()
+        self.anybodycon_path = Path(anybodycon_path)
+        if not self.anybodycon_path.is_file():
+            raise IOError(f"Can not find anybodycon: {self.anybodycon_path}")
+        self.folder = str(folder or os.getcwd())
+        self.env = env
+        self.priority = priority
+        self.debug_mode = debug_mode
+        self.ignore_errors = ignore_errors
+        self.warnings_to_include = warnings_to_include
+        self.fatal_warnings = fatal_warnings
+        self.logfile = logfile
+        self.number_of_runs = 0
+        self._proc = None
+        self._lines = Queue()
+        self._reader = None
+        self._mark_counter = 0
+        self._values_file = None
+
+    @property
+    def is_alive(self):
+        """True if the console application is running."""
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self, timeout=120):
+        """Start the console application and wait until it accepts commands."""
+        if self.is_alive:
+            return
+        cmd = self._command()
+        kwargs = {
+            "stdin": subprocess.PIPE,
+            "stdout": subprocess.PIPE,
+            "stderr": subprocess.STDOUT,
+            "env": self.env,
+            "cwd": self.folder,
+            "encoding": "utf8",
+            "errors": "backslashreplace",
+            "bufsize": 1,
+        }
+        if ON_WINDOWS:
+            kwargs["creationflags"] = (
+                0x8000000 | self.priority | subprocess.CREATE_NEW_PROCESS_GROUP
+            )
+        self._proc = Popen(cmd, **kwargs)
+        _global_subprocess_container.add(self._proc.pid)
+        self._lines = Queue()
+        self._reader = Thread(
+            target=self._read_output, args=(self._proc.stdout, self._lines)
+        )
+        self._reader.daemon = True
+        self._reader.start()
+        self._communicate([], timeout=timeout)
+
+    def _command(self):
+        """Return the command line which starts the console application."""
+        cmd = [str(self.anybodycon_path.resolve()), "/deb", str(self.debug_mode)]
+        if not ON_WINDOWS:
+            cmd.insert(0, "wine")
+        return cmd
+
+    @staticmethod
+    def _read_output(stream, lines):
+        for line in iter(stream.readline, ""):
+            lines.put(line.rstrip("\r\n"))
+        lines.put(None)
+
+    def _communicate(self, macro_lines, timeout=None):
+        """Send macro commands and return the output lines they produce."""
+        self._mark_counter += 1
+        mark = f"{_SESSION_MARK} {self._mark_counter}"
+        try:
+            for line in macro_lines + [f'print "{mark}"']:
+                self._proc.stdin.write(line + "\n")
+            self._proc.stdin.flush()
+        except OSError as e:
+            raise AnyBodySessionError("AnyBody console application has exited") from e
+        deadline = None if timeout is None else time.monotonic() + timeout
+        output = []
+        while True:
+            wait = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                line = self._lines.get(timeout=wait)
+            except Empty:
+                self.close(force=True)
+                raise AnyBodySessionError(
+                    f"Timeout after {timeout} sec waiting for AnyBody"
+                ) from None
+            if line is None:
+                retcode = ctypes.c_int32(self._proc.wait()).value
+                self._append_to_logfile(output)
+                raise AnyBodySessionError(
+                    f"AnyBody console application exited. Return code: {retcode}\n"
+                    + "\n".join(output[-20:])
+                )
+            if line.strip() == mark:
+                break
+            output.append(line)
+        self._append_to_logfile(output)
+        return output
+
+    def _append_to_logfile(self, lines):
+        if self.logfile:
+            with open(self.logfile, "a", encoding="utf8") as fh:
+                fh.write("\n".join(lines) + "\n")
+
+    def run(self, macro, timeout=None):
+        """Run macro commands in the session.
+
+        Parameters
+        ----------
+        macro : str or MacroCommand or list
+            The macro commands to run.
+        timeout : int, optional
+            Maximum time (in seconds) to wait for the commands to finish.
+            If the timeout expires the session is closed.
+
+        Returns
+        -------
+        AnyPyProcessOutput
+            The output parsed from the log of the commands.
+        """
+        if not self.is_alive:
+            self.start()
+        lines = _macro_lines(macro)
+        raw = self._communicate(lines, timeout=timeout)
+        self.number_of_runs += 1
+        return parse_anybodycon_output(
+            "\n".join(raw),
+            self.ignore_errors,
+            self.warnings_to_include,
+            fatal_warnings=self.fatal_warnings,
+        )
+
+    def close(self, timeout=10, force=False):
+        """Exit the console application."""
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        if proc.poll() is None and not force:
+            with suppress(OSError):
+                proc.stdin.write("exit\n")
+                proc.stdin.flush()
+            with suppress(subprocess.TimeoutExpired):
+                proc.wait(timeout=timeout)
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        _global_subprocess_container.remove(proc.pid)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        proc = getattr(self, "_proc", None)
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+
+
+def _has_errors(lines):
+    return any(ERROR_PATTERN.match(line) for line in lines)
+
+
+class AnyBodySessionPool(object):
+    """Pool of warm AnyBody sessions grouped by their ``load`` macro command.
+
+    Macros which start with the same ``load`` command (i.e. the same model
+    file, defines and paths) in the same folder are run in an idle session
+    which already has the model loaded, instead of starting a new AnyBody
+    process and reloading the model.
+
+    Parameters
+    ----------
+    max_sessions : int, optional
+        Maximum number of sessions kept alive. When the pool is full the least
+        recently used idle session is closed to make room for a new one. If all
+        sessions are busy, `run` waits until one is released. (Defaults to 4)
+    max_runs_per_session : int, optional
+        Sessions are recycled (restarted) after running this many macros.
+        (Defaults to 100)
+    reset : str or None, optional
+        How the model state is reset between two macros running in the same
+        session. ``"values"`` saves all values after loading the model, and
+        loads them again before each macro (``Save Values``/``Load Values``).
+        ``"reload"`` loads the model again before each macro. None does
+        not reset the model. (Defaults to "values")
+    recycle_on_error : bool, optional
+        Close the session after a macro which reported errors, so the next
+        macro starts from a freshly loaded model. (Defaults to True)
+    **session_kwargs :
+        Extra arguments passed to `AnyBodySession` (e.g. ``anybodycon_path``,
+        ``env``, ``priority``).
+
+    Examples
+    --------
+    >>> with AnyBodySessionPool(max_sessions=2) as pool:
+    ...     for value in [1, 2, 3]:
+    ...         lines = pool.run(
+    ...             "path/to/model",
+    ...             ['load "main.any"', f'classoperation Main.Var "Set Value" --value="{value}"',
+    ...              "operation Main.Study.InverseDynamics", "run"],
+    ...         )
+
+    """
+
+    _RESET_STRATEGIES = ("values", "reload", None)
+    session_class = AnyBodySession
+
+    def __init__(
+        self,
+        max_sessions=4,
+        max_runs_per_session=100,
+        reset="values",
+        recycle_on_error=True,
+        **session_kwargs,
+    ):
+        if reset not in self._RESET_STRATEGIES:
+            raise ValueError(f"reset must be one of {self._RESET_STRATEGIES}")
+        self.max_sessions = max_sessions
+        self.max_runs_per_session = max_runs_per_session
+        self.reset = reset
+        self.recycle_on_error = recycle_on_error
+        self.session_kwargs = session_kwargs
+        self._idle = collections.OrderedDict()
+        self._n_sessions = 0
+        self._lock = RLock()
+        # Notified when a session is released or closed
+        self._available = Condition(self._lock)
+
+    def _values_file(self, session):
+        with NamedTemporaryFile(suffix=".anyset", delete=False) as fh:
+            session._values_file = fh.name
+        if ON_WINDOWS:
+            return session._values_file
+        return winepath(session._values_file, "--windows")
+
+    def _new_session(self, folder, load_cmd, timeout):
+        """Start a new session and load the model."""
+        try:
+            session = self.session_class(folder=folder, **self.session_kwargs)
+            session.start()
+        except Exception:
+            with self._lock:
+                self._n_sessions -= 1
+                self._available.notify_all()
+            raise
+        macro = [load_cmd]
+        if self.reset == "values":
+            macro.append(SaveValues(self._values_file(session)).get_macro(0))
+        try:
+            lines = session._communicate(macro, timeout=timeout)
+        except AnyBodySessionError:
+            self._close_session(session)
+            raise
+        return session, lines
+
+    def _reset_macro(self, session, load_cmd):
+        if self.reset == "values":
+            filename = session._values_file
+            if not ON_WINDOWS:
+                filename = winepath(filename, "--windows")
+            return [LoadValues(filename).get_macro(0)]
+        elif self.reset == "reload":
+            return [load_cmd]
+        return []
+
+    def _acquire(self, key):
+        """Return an idle session for the key, or None if a new is needed.
+
+        Waits until a session is released when the pool is full and all
+        sessions are busy.
+        """
+        with self._lock:
+            while True:
+                idle = self._idle.get(key)
+                if idle:
+                    session = idle.pop()
+                    if not idle:
+                        del self._idle[key]
+                    return session
+                if self._n_sessions < self.max_sessions:
+                    self._n_sessions += 1
+                    return None
+                if self._idle:
+                    self._evict_idle()
+                else:
+                    self._available.wait()
+
+    def _evict_idle(self):
+        """Close the least recently used idle session."""
+        for key in list(self._idle):
+            session = self._idle[key].pop(0)
+            if not self._idle[key]:
+                del self._idle[key]
+            self._close_session(session)
+            return
+
+    def _close_session(self, session):
+        with self._lock:
+            self._n_sessions -= 1
+            self._available.notify_all()
+        session.close()
+        silentremove(session._values_file)
+
+    def _release(self, key, session, healthy):
+        if (
+            not healthy
+            or not session.is_alive
+            or session.number_of_runs >= self.max_runs_per_session
+        ):
+            self._close_session(session)
+            return
+        with self._lock:
+            self._idle.setdefault(key, []).append(session)
+            self._idle.move_to_end(key)
+            self._available.notify_all()
+
+    def run(self, folder, macro, timeout=None):
+        """Run a macro in a warm session.
+
+        The first command of the macro must be a ``load`` command.
+        Returns the output lines from AnyBody.
+        """
+        macro = _macro_lines(macro)
+        macro = [cmd for cmd in macro if cmd.strip() != "exit"]
+        if not _starts_with_load(macro):
+            raise ValueError("Macros run in warm sessions must start with 'load'")
+        load_cmd, macro = macro[0], macro[1:]
+        key = (str(folder), load_cmd)
+        session = self._acquire(key)
+        lines = []
+        healthy = False
+        try:
+            if session is None:
+                session, lines = self._new_session(folder, load_cmd, timeout)
+                if _has_errors(lines):
+                    # Sessions where model loading failed are not reused
+                    return lines
+            else:
+                macro = self._reset_macro(session, load_cmd) + macro
+            lines += session._communicate(macro, timeout=timeout)
+            session.number_of_runs += 1
+            healthy = not (self.recycle_on_error and _has_errors(lines))
+            return lines
+        finally:
+            if session is not None:
+                self._release(key, session, healthy)
+
+    def close(self):
+        """Close all idle sessions."""
+        with self._lock:
+            sessions = [s for idle in self._idle.values() for s in idle]
+            self._idle.clear()
+        for session in sessions:
+            self._close_session(session)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -11,9 +11,12 @@ import collections
 import copy
 import datetime
 import errno
+import fnmatch
 import functools
 import logging
+import mmap
 import os
+import pickle
 import platform
 import pprint
 import re
@@ -23,10 +26,12 @@ import sys
 import textwrap
 import warnings
 import xml
+import zlib
 from _thread import get_ident as _get_ident
 from ast import literal_eval
 from contextlib import suppress
 from dataclasses import dataclass
+from multiprocessing import shared_memory
 from pathlib import Path
 from typing import Any, Iterable
 import inspect
@@ -34,6 +39,8 @@ import inspect
 # external imports
 import numpy as np
 
+from .wineutils import get_path_translator
+
 logger = logging.getLogger("abt.anypytools")
 
 
@@ -48,6 +55,7 @@ __all__ = [
     "winepath",
     "anybodycon_version",
     "AMSVersion",
+    "AnyBodyConLogParser",
     "parse_anybodycon_output",
     "wraptext",
 ]
@@ -105,15 +113,32 @@ def case_preserving_replace(string, old, new):
 
 
 @functools.lru_cache(maxsize=None)
-def winepath(path, opts=None):
-    """Wrapper for the winepath commandline tool"""
+def winepath(path, opts=None, prefix=None):
+    """Wrapper for the winepath commandline tool
+
+    The translation is cached for each Wine `prefix`. If `prefix` is None the
+    ``WINEPREFIX`` of the current environment is used. Unix/Windows
+    translations are done in-process from the ``dosdevices`` of the
+    prefix. The ``winepath`` tool is only used as a fallback.
+    """
     if not opts:
         opts = ["-u"]
     if isinstance(opts, str):
         opts = [opts]
+    if opts in (["-w"], ["--windows"], ["-u"], ["--unix"]):
+        translator = get_path_translator(prefix)
+        if opts[0] in ("-w", "--windows"):
+            out = translator.to_windows(path)
+        else:
+            out = translator.to_unix(path)
+        if out is not None:
+            return out
+    env = None
+    if prefix is not None:
+        env = dict(os.environ, WINEPREFIX=str(prefix))
     try:
         out = subprocess.check_output(
-            ["winepath", *opts, f"{path}"], universal_newlines=True
+            ["winepath", *opts, f"{path}"], universal_newlines=True, env=env
         )
     except (subprocess.CalledProcessError, FileNotFoundError):
         return ""
@@ -377,6 +402,50 @@ def _get_first_key_match(key, names):
     return matching[0]
 
 
+class _LazyValue(object):
+    """Text of an exported value which is parsed when it is first used.
+
+    Large values are kept compressed, which takes less memory than the parsed
+    array.
+    """
+
+    __slots__ = ("name", "data")
+
+    #: Values longer than this are compressed
+    compress_size = 2**16
+
+    def __init__(self, name, text):
+        self.name = name
+        if len(text) > self.compress_size:
+            self.data = zlib.compress(text.encode("utf8"), 1)
+        else:
+            self.data = text
+
+    @property
+    def text(self):
+        if isinstance(self.data, bytes):
+            return zlib.decompress(self.data).decode("utf8")
+        return self.data
+
+    def parse(self):
+        return _parse_export(self.name, self.text)
+
+    def __repr__(self):
+        return f"<unparsed value of {len(self.data)} bytes>"
+
+
+def _exact_item(output, key):
+    """Return ``output[key]`` without partial key matching.
+
+    Lazy values are parsed, and the result replaces the lazy value.
+    """
+    value = collections.OrderedDict.__getitem__(output, key)
+    if isinstance(value, _LazyValue):
+        value = value.parse()
+        collections.OrderedDict.__setitem__(output, key, value)
+    return value
+
+
 class AnyPyProcessOutputList(collections.abc.MutableSequence):
     """List like class to wrap the output of model simulations.
 
@@ -404,26 +473,21 @@ class AnyPyProcessOutputList(collections.abc.MutableSequence):
             # Find the entries where i matches the keys
             key = _get_first_key_match(item, self.list[0])
             key_in_all_elements = all(
-                super(AnyPyProcessOutput, e).__contains__(key) for e in self.list
+                collections.OrderedDict.__contains__(e, key) for e in self.list
             )
             if not key_in_all_elements:
                 raise KeyError(
                     f" The key: '{key}' is not present in all elements of the output."
                 ) from None
             try:
-                data = np.array(
-                    [super(AnyPyProcessOutput, e).__getitem__(key) for e in self.list]
-                )
+                data = np.array([_exact_item(e, key) for e in self.list])
             except ValueError:
                 warnings.warn(
                     "\nThe length of the time variable varies across macros. "
                     "Numpy does not support ragged arrays. Data is returned  "
                     "as an array of array objects"
                 )
-                data = np.array(
-                    [super(AnyPyProcessOutput, e).__getitem__(key) for e in self.list],
-                    dtype=object,
-                )
+                data = np.array([_exact_item(e, key) for e in self.list], dtype=object)
             return data
         else:
             return (
@@ -546,6 +610,7 @@ class AnyPyProcessOutputList(collections.abc.MutableSequence):
                     "task_processtime",
                     "task_logfile",
                     "task_id",
+                    "task_timeout",
                 ],
                 axis=1,
                 errors="ignore",
@@ -694,7 +759,11 @@ def array2anyscript(arr):
 
 
 class AnyPyProcessOutput(collections.OrderedDict):
-    """Subclassed OrderedDict which supports partial key access."""
+    """Subclassed OrderedDict which supports partial key access.
+
+    Values may be stored unparsed (see `parse_anybodycon_output`). They are
+    parsed the first time they are accessed.
+    """
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -702,16 +771,40 @@ class AnyPyProcessOutput(collections.OrderedDict):
 
     def __getitem__(self, key):
         try:
-            return super(AnyPyProcessOutput, self).__getitem__(key)
+            return _exact_item(self, key)
         except KeyError:
             key = _get_first_key_match(key, super(AnyPyProcessOutput, self).keys())
 
         try:
-            return super(AnyPyProcessOutput, self).__getitem__(key)
+            return _exact_item(self, key)
         except KeyError:
             msg = f"The key {key} could not be found in the data"
             raise KeyError(msg) from None
 
+    def get(self, key, default=None):
+        if collections.OrderedDict.__contains__(self, key):
+            return _exact_item(self, key)
+        return default
+
+    def items(self):
+        return collections.abc.ItemsView(self)
+
+    def values(self):
+        return collections.abc.ValuesView(self)
+
+    def pop(self, key, *args):
+        value = super().pop(key, *args)
+        return value.parse() if isinstance(value, _LazyValue) else value
+
+    def popitem(self, last=True):
+        key, value = super().popitem(last)
+        return key, value.parse() if isinstance(value, _LazyValue) else value
+
+    def __reduce__(self):
+        # Keep unparsed values unparsed when pickling
+        state = self.__dict__.copy() or None
+        return self.__class__, (), state, None, iter(super().items())
+
     def _repr_gen(self, prefix):
         kv_values = {
             k: v
@@ -897,8 +990,87 @@ TRIPEL_QUOTE_WRAP = re.compile(r'([^\[\]",\s]+)')
 QUOTE_INF_NAN = re.compile(r"([-]?(nan|inf))(?=[,\]])")
 
 
+_NON_NUMERIC_ARRAY = re.compile(r"[^\d\s,.eE+\-{}naif]")
+_FLOAT_CHARS = re.compile(r"[.eEn]")
+_INNERMOST_GROUP = re.compile(r"\{([^{}]*)\}")
+_NOT_BRACES = re.compile(r"[^{}]+")
+_REMOVE_BRACES = str.maketrans("", "", "{}")
+
+
+def _group_shape(skeleton, ndim):
+    """Return the number of sub-groups at each level of nested braces.
+
+    The counts are taken from the first group at each level.
+    """
+    shape = []
+    for start in range(ndim - 1):
+        level, count = 0, 0
+        for char in skeleton[start + 1 :]:
+            if char == "{":
+                if level == 0:
+                    count += 1
+                level += 1
+            elif level == 0:
+                break
+            else:
+                level -= 1
+        shape.append(count)
+    return shape
+
+
+def _parse_numeric_array(val):
+    """Parse an AnyScript array of numbers (e.g. '{{1.0, 2.0}, {3.0, nan}}').
+
+    The shape is found from the structure of the braces, and the numbers are
+    converted in bulk by NumPy. Returns None if the value is not a regular
+    array of numbers.
+    """
+    if not val.startswith("{") or _NON_NUMERIC_ARRAY.search(val):
+        return None
+    groups = _INNERMOST_GROUP.findall(val)
+    lengths = {group.count(",") for group in groups}
+    if len(lengths) != 1 or not all(group.strip() for group in groups):
+        return None
+    ndim = len(val) - len(val.lstrip("{"))
+    skeleton = _NOT_BRACES.sub("", val)
+    shape = _group_shape(skeleton, ndim)
+    expected_skeleton = "{}"
+    for size in reversed(shape):
+        expected_skeleton = "{" + expected_skeleton * size + "}"
+    if skeleton != expected_skeleton:
+        return None
+    shape.append(lengths.pop() + 1)
+    dtype = float if _FLOAT_CHARS.search(val) else int
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            out = np.fromstring(val.translate(_REMOVE_BRACES), dtype=dtype, sep=",")
+    except (ValueError, DeprecationWarning):
+        return None
+    if out.size != np.prod(shape):
+        return None
+    return out.reshape(shape)
+
+
 def _parse_data(val):
     """Convert a str AnyBody data repr into Numpy array."""
+    out = _parse_numeric_array(val)
+    if out is not None:
+        return out
+    return _parse_data_literal(val)
+
+
+def _parse_export(name, val):
+    """Parse an exported value. Returns the text if it can not be parsed."""
+    try:
+        return _parse_data(val)
+    except (SyntaxError, ValueError):
+        warnings.warn("\n\nCould not parse console output:\n" + name)
+        return val
+
+
+def _parse_data_literal(val):
+    """Convert a str AnyBody data repr using ``ast.literal_eval``."""
     if val.startswith("{") and val.endswith("}"):
         val = val.replace("{", "[").replace("}", "]")
     if val == "[...]":
@@ -969,12 +1141,460 @@ EXPORT_PATTERN = re.compile(
 )
 
 
+def _contains_any(line, substrings):
+    """Return True if any of the substrings are found in line."""
+    return any(substring in line for substring in substrings)
+
+
+def _trie_regex(node):
+    """Return a regular expression matching the strings in a trie node."""
+    if "" in node:
+        # A string ends here, so longer strings are not needed for a match
+        return ""
+    alternatives = []
+    for char in sorted(node):
+        text, child = re.escape(char), node[char]
+        while len(child) == 1 and "" not in child:
+            ((char, child),) = child.items()
+            text += re.escape(char)
+        alternatives.append(text + _trie_regex(child))
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return "(?:" + "|".join(alternatives) + ")"
+
+
+@functools.lru_cache(maxsize=32)
+def _substring_pattern(substrings):
+    """Compile a tuple of substrings into a single regular expression.
+
+    ``pattern.search(line)`` finds any of the substrings in one pass over
+    the line. The substrings are merged into a trie, so lines are not matched
+    against each substring in turn. The compiled patterns are cached, and
+    reused by all tasks with the same substrings.
+    """
+    if not substrings:
+        return re.compile(r"(?!)")
+    trie = {}
+    for substring in substrings:
+        node = trie
+        for char in substring:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    return re.compile(_trie_regex(trie))
+
+
+_RENAME_LINE = re.compile(r"#### ANYPYTOOLS RENAME OUTPUT:\s(?P<rename>.+)")
+_DUMP_COMMAND_LINE = re.compile(
+    r"#### Macro command >"
+    r' (?:classoperation|print)\s?(?P<rename>\S+)\s?(?:"Dump")?\s*$'
+)
+_EXPORT_LINE = re.compile(r"(?P<name>[^#][^\s=]*?)\s=(?:\s|$)")
+
+
+def _glob_pattern(patterns):
+    """Compile names or glob patterns into a single regular expression."""
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    if not patterns:
+        return re.compile(r"(?!)")
+    return re.compile("|".join(fnmatch.translate(p) for p in patterns))
+
+
+class _PendingExport(object):
+    """An exported value which continues on the following lines.
+
+    Continuation lines start with two whitespace characters, where a line
+    break also counts as whitespace. The value ends at the last ``;`` before
+    the first line which does not continue it.
+    """
+
+    def __init__(self, name, value, dump_command, name_override, start=0):
+        self.name = name
+        # Index of the first line in the log
+        self.start = start
+        # The value starts on the next line if it is None
+        self.value = value
+        self.lines = []
+        self.complete = False
+        self._starts_on_next_line = value is None
+        self.dump_command = dump_command
+        self.name_override = name_override
+        # Number of whitespace characters that must start the next line
+        self._indent = 2
+
+    def add_line(self, line):
+        """Add a line to the value. Returns False if the line does not continue it."""
+        if self.value is None:
+            end = line.find(";")
+            self.value = line if end < 0 else line[:end]
+            self.complete = end >= 0
+            return True
+        if self._indent:
+            leading = len(line) - len(line.lstrip())
+            if leading < min(self._indent, len(line)):
+                return False
+            if leading == len(line) < self._indent:
+                # Short blank line. The line break counts as whitespace as well.
+                self._indent -= len(line) + 1
+                self.lines.append(line)
+                return True
+        self._indent = 2
+        self.lines.append(line)
+        return True
+
+    @property
+    def n_lines(self):
+        """The number of lines added after the first line."""
+        if self._starts_on_next_line and self.value is not None:
+            return len(self.lines) + 1
+        return len(self.lines)
+
+    def resolve(self):
+        """Return the value and the lines after its end.
+
+        The value is None if it is not terminated.
+        """
+        if self.complete:
+            return self.value, []
+        for i in range(len(self.lines) - 1, -1, -1):
+            end = self.lines[i].rfind(";")
+            if end >= 0:
+                value = "\n".join([self.value] + self.lines[:i] + [self.lines[i][:end]])
+                return value, self.lines[i + 1 :]
+        if self._starts_on_next_line:
+            return None, [self.value] + self.lines
+        return None, self.lines
+
+
+class AnyBodyConLogParser(object):
+    """Incremental parser of the output from AnyBodyConsole.
+
+    The parser is fed the log while it is written, and keeps a partially
+    built `AnyPyProcessOutput`. Exported values which span several lines or
+    chunks are completed when the rest of their text arrives. When the
+    process exits, the result is ready after parsing the last part of the log.
+
+    The log is scanned once, line by line. Each line is classified as a
+    rename marker, a dump macro command, the first line of an exported value,
+    a continuation of a multi-line value, an error or a warning.
+
+    Parameters
+    ----------
+    errors_to_ignore : list of str, optional
+        Errors which contain any of these strings are ignored.
+    warnings_to_include : list of str, optional
+        Warnings which contain any of these strings are included in the output.
+    fatal_warnings : bool, optional
+        If True, the included warnings are also added to the errors.
+    lazy : bool, optional
+        If True, exported arrays are kept as text and only parsed when they
+        are first accessed in the output. (Defaults to False)
+    keep : list of str, optional
+        Names or glob patterns (e.g. ``"Main.Study.Output.*"``) of the exported
+        values to keep. The names are matched after exports have been renamed.
+        Other values are skipped without being parsed, and the lines they span
+        are recorded in `skipped_lines`. (Defaults to None, which keeps all
+        values)
+
+    Examples
+    --------
+    >>> parser = AnyBodyConLogParser()
+    >>> for chunk in iter(lambda: proc.stdout.read(65536), ""):
+    ...     parser.feed_text(chunk)
+    >>> output = parser.finish()
+
+    """
+
+    def __init__(
+        self,
+        errors_to_ignore=None,
+        warnings_to_include=None,
+        fatal_warnings=False,
+        lazy=False,
+        keep=None,
+    ):
+        self.errors_to_ignore = errors_to_ignore or []
+        self.warnings_to_include = warnings_to_include or []
+        self.fatal_warnings = fatal_warnings
+        self._ignore_pattern = _substring_pattern(tuple(self.errors_to_ignore))
+        self._include_pattern = _substring_pattern(tuple(self.warnings_to_include))
+        self.lazy = lazy
+        self._keep_pattern = _glob_pattern(keep) if keep is not None else None
+        #: Line ranges (start, stop) of the exported values which were not kept
+        self.skipped_lines = []
+        self._line_index = -1
+        #: The output found so far
+        self.output = AnyPyProcessOutput()
+        self.error_list = []
+        self.warning_list = []
+        self._fatal_warnings = []
+        self._prefix_replacement = ("", "")
+        # Rename marker on the previous line
+        self._rename = None
+        # Dump macro command waiting for the first exported value
+        self._dump_command = False
+        self._name_override = None
+        # Exported value which continues on the following lines
+        self._export = None
+        # Text after the last line break fed with feed_text()
+        self._partial = []
+
+    def _add_export(self, name, value, dump_command, name_override, lines):
+        if dump_command:
+            if name_override:
+                self._prefix_replacement = (name, name_override)
+            else:
+                self._prefix_replacement = ("", "")
+        name = name.replace(*self._prefix_replacement)
+        if self._keep_pattern is not None and not self._keep_pattern.match(name):
+            self.skipped_lines.append(lines)
+            return
+        if self.lazy and value.startswith("{") and value != "{...}":
+            value = _LazyValue(name, value)
+        else:
+            value = _parse_export(name, value)
+        if value is not None:
+            self.output[name] = value
+
+    def _check_messages(self, line):
+        if ERROR_PATTERN.match(line):
+            if not self._ignore_pattern.search(line):
+                self.error_list.append(line)
+        elif WARNING_PATTERN.match(line) and self._include_pattern.search(line):
+            if self.fatal_warnings and not self._ignore_pattern.search(line):
+                self._fatal_warnings.append(line)
+            self.warning_list.append(line)
+
+    def _end_export(self):
+        """Add the pending multi-line value, and scan the lines after it again."""
+        export, self._export = self._export, None
+        value, lines = export.resolve()
+        end = export.start + 1 + export.n_lines - len(lines)
+        if value is not None:
+            self._add_export(
+                export.name,
+                value,
+                export.dump_command,
+                export.name_override,
+                (export.start, end),
+            )
+        current = self._line_index
+        for i, line in enumerate(lines):
+            self._line_index = end + i
+            self._scan_line(line)
+        self._line_index = current
+
+    def _scan_line(self, line):
+        if self._export is not None:
+            if self._export.add_line(line):
+                if self._export.complete:
+                    self._end_export()
+                return
+            self._end_export()
+            self._scan_line(line)
+            return
+        rename, self._rename = self._rename, None
+        if not line or line.isspace():
+            return
+        if line.startswith("#"):
+            self._dump_command = False
+            match = _RENAME_LINE.match(line)
+            if match:
+                self._rename = match.group("rename")
+                return
+            match = _DUMP_COMMAND_LINE.match(line)
+            if match:
+                self._dump_command = True
+                self._name_override = rename or match.group("rename")
+            return
+        dump_command, self._dump_command = self._dump_command, False
+        match = _EXPORT_LINE.match(line)
+        if match is None:
+            return
+        name, value = match.group("name"), line[match.end() :]
+        if match.end() == len(line) and line.endswith("="):
+            # The line break is the whitespace after the equal sign
+            value = None
+        end = -1 if value is None else value.find(";")
+        if end < 0:
+            self._export = _PendingExport(
+                name, value, dump_command, self._name_override, self._line_index
+            )
+        else:
+            self._add_export(
+                name,
+                value[:end],
+                dump_command,
+                self._name_override,
+                (self._line_index, self._line_index + 1),
+            )
+
+    def feed_line(self, line):
+        """Parse a single line of the log (without the line ending)."""
+        self._line_index += 1
+        self._check_messages(line)
+        self._scan_line(line)
+
+    def feed(self, lines):
+        """Parse several lines of the log.
+
+        This makes the parser usable as a log consumer, which is fed the new
+        lines of the log while the process runs.
+        """
+        for line in lines:
+            self.feed_line(line)
+
+    def feed_text(self, text):
+        """Parse a chunk of the log. Chunks may start or end in the middle of a line."""
+        if "\n" not in text:
+            self._partial.append(text)
+            return
+        first, *lines = text.split("\n")
+        self._partial.append(first)
+        lines.insert(0, "".join(self._partial))
+        self._partial = [lines.pop()]
+        self.feed(lines)
+
+    def finish(self):
+        """Parse the rest of the log and return the output."""
+        if self._partial:
+            self.feed_line("".join(self._partial))
+            self._partial = []
+        while self._export is not None:
+            self._end_export()
+        error_list = self.error_list + self._fatal_warnings
+        if error_list:
+            self.output["ERROR"] = error_list
+        if self.warning_list:
+            self.output["WARNING"] = self.warning_list
+        return self.output
+
+
+def _iter_logfile_lines(path):
+    """Yield the lines of a log file without reading the whole file into memory.
+
+    The file is memory mapped and only one line at a time is decoded. Line
+    endings are translated as when reading the file in text mode.
+    """
+    with open(path, "rb") as fh:
+        try:
+            data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can not be memory mapped
+            yield ""
+            return
+        with data:
+            pos = 0
+            while True:
+                end = data.find(b"\n", pos)
+                line = data[pos:] if end < 0 else data[pos:end]
+                if end >= 0 and line.endswith(b"\r"):
+                    line = line[:-1]
+                if b"\r" in line:
+                    for part in line.split(b"\r"):
+                        yield part.decode("utf8", errors="backslashreplace")
+                else:
+                    yield line.decode("utf8", errors="backslashreplace")
+                if end < 0:
+                    break
+                pos = end + 1
+
+
 def parse_anybodycon_output(
-    raw, errors_to_ignore=None, warnings_to_include=None, fatal_warnings=False
+    raw,
+    errors_to_ignore=None,
+    warnings_to_include=None,
+    fatal_warnings=False,
+    lazy=False,
+    keep=None,
 ):
     """Parse the output log file from AnyBodyConsole to
     for data, errors and warnings. If fatal_warnins is
     True, then warnings are also added to the error list.
+
+    `raw` is either the content of the log file, or the path to the log file
+    as a ``pathlib.Path`` object. Log files are memory mapped and scanned line
+    by line, so the memory use does not grow with the size of the log.
+
+    With ``lazy=True`` the text of exported arrays is kept, and each array is
+    only converted to NumPy the first time it is accessed in the output.
+
+    `keep` is a list of names or glob patterns of the exported values to
+    include in the output. Other values are not parsed.
+    """
+    parser = AnyBodyConLogParser(
+        errors_to_ignore, warnings_to_include, fatal_warnings, lazy=lazy, keep=keep
+    )
+    if isinstance(raw, os.PathLike):
+        parser.feed(_iter_logfile_lines(raw))
+    else:
+        parser.feed(raw.split("\n"))
+    return parser.finish()
+
+
+def _parse_logfile_in_worker(logfile, parser_options):
+    """Parse a log file in a worker process of a process pool.
+
+    The output is pickled with protocol 5, and the data of the NumPy arrays
+    is placed out-of-band in a single shared memory block. Only the small
+    pickle and the name of the shared memory block are sent back through the
+    pool, which `_load_parsed_logfile` turns into the output again.
+
+    Returns
+    -------
+    tuple
+        The pickled output and skipped lines, the name of the shared memory
+        block (or None if there are no arrays), and the size of each array
+        buffer.
+    """
+    parser = AnyBodyConLogParser(**parser_options)
+    parser.feed(_iter_logfile_lines(Path(logfile)))
+    output = parser.finish()
+    buffers = []
+    data = pickle.dumps(
+        (output, parser.skipped_lines), protocol=5, buffer_callback=buffers.append
+    )
+    if not buffers:
+        return data, None, []
+    views = [buffer.raw() for buffer in buffers]
+    sizes = [view.nbytes for view in views]
+    shm = shared_memory.SharedMemory(create=True, size=max(sum(sizes), 1))
+    try:
+        offset = 0
+        for view, size in zip(views, sizes):
+            shm.buf[offset : offset + size] = view
+            offset += size
+    finally:
+        shm.close()
+    return data, shm.name, sizes
+
+
+def _load_parsed_logfile(data, shm_name, sizes):
+    """Return the output and skipped lines sent by `_parse_logfile_in_worker`.
+
+    The array data is copied out of the shared memory block, which is then
+    removed.
+    """
+    buffers = []
+    if shm_name is not None:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            offset = 0
+            for size in sizes:
+                buffers.append(bytearray(shm.buf[offset : offset + size]))
+                offset += size
+        finally:
+            shm.close()
+            shm.unlink()
+    return pickle.loads(data, buffers=buffers)
+
+
+def _parse_anybodycon_output_regex(
+    raw, errors_to_ignore=None, warnings_to_include=None, fatal_warnings=False
+):
+    """Regular expression based version of `parse_anybodycon_output`.
+
+    Kept as the reference implementation for `AnyBodyConLogParser`.
     """
     warnings_to_include = warnings_to_include or []
     errors_to_ignore = errors_to_ignore or []
@@ -1000,10 +1620,7 @@ def parse_anybodycon_output(
     error_list = []
 
     def _add_non_ignored_errors(error_line):
-        for ignored_err in errors_to_ignore:
-            if ignored_err in error_line:
-                break
-        else:
+        if not _contains_any(error_line, errors_to_ignore):
             error_list.append(error_line)
 
     # Find all errors in logfile
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Utilities for running the AnyBody Console application through Wine on Linux.
+"""
+
+import functools
+import logging
+import os
+import shutil
+import subprocess
+from contextlib import suppress
+from pathlib import Path
+
+logger = logging.getLogger("abt.anypytools")
+
+__all__ = ["WineServer", "WinePrefixPool", "WinePathTranslator"]
+
+
+def default_wineprefix(env=None):
+    """Return the Wine prefix used by default in the environment `env`."""
+    env = os.environ if env is None else env
+    return Path(env.get("WINEPREFIX", Path.home() / ".wine"))
+
+
+class WineServer(object):
+    """Keep the ``wineserver`` of a Wine prefix running between tasks.
+
+    Every ``wine`` invocation needs a running wineserver. When no server
+    is resident, the first process pays for starting the server and
+    initialising the prefix, and concurrent starts serialise on it. This
+    class starts the server with a persistence delay (``wineserver -p N``),
+    and waits until the prefix answers requests. The server then stays up
+    for `persistence` seconds after the last wine process has ended, and
+    exits by itself. It is never killed, since other processes using the
+    same prefix (e.g. concurrent jobs) may share the server. If a server is
+    already running for the prefix, it is reused as is.
+
+    Parameters
+    ----------
+    prefix : str, optional
+        The Wine prefix to start the server for. Defaults to the
+        ``WINEPREFIX`` of `env`/the current environment.
+    env : dict, optional
+        Environment used when starting the wine processes.
+        (Defaults to None, which uses ``os.environ``)
+    startup_timeout : int, optional
+        Maximum time (in seconds) to wait for the prefix to become ready.
+        (Defaults to 120 seconds)
+    persistence : int, optional
+        Time (in seconds) the server keeps running after the last wine
+        process has ended. (Defaults to 60 seconds)
+
+    Examples
+    --------
+    >>> with WineServer():
+    ...     app.start_macro(macrolist)
+
+    """
+
+    def __init__(self, prefix=None, env=None, startup_timeout=120, persistence=60):
+        self.env = dict(env or os.environ)
+        if prefix is not None:
+            self.env["WINEPREFIX"] = str(prefix)
+        self.prefix = self.env.get("WINEPREFIX")
+        self.startup_timeout = startup_timeout
+        self.persistence = persistence
+        #: True when the server has been started and the prefix is ready
+        self.ready = False
+
+    def start(self):
+        """Start the server and block until the prefix is ready.
+
+        Returns
+        -------
+        bool
+            True if the prefix is ready for use.
+        """
+        if shutil.which("wineserver") is None or shutil.which("wine") is None:
+            logger.debug("wine/wineserver not found. No persistent wineserver")
+            return False
+        if self.ready:
+            return True
+        try:
+            # The server puts itself in the background, or exits right away
+            # if a server is already running for the prefix.
+            subprocess.run(
+                ["wineserver", f"--persistent={int(self.persistence)}"],
+                env=self.env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=self.startup_timeout,
+            )
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Timeout starting wineserver for prefix: {self.prefix}")
+            return False
+        self.ready = self._wait_ready()
+        return self.ready
+
+    def _wait_ready(self):
+        """Run a trivial wine command to finish prefix initialisation."""
+        try:
+            subprocess.run(
+                ["wine", "cmd", "/c", "exit"],
+                env=self.env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=self.startup_timeout,
+            )
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Timeout waiting for Wine prefix: {self.prefix}")
+            return False
+        return True
+
+    def stop(self):
+        """Release the server.
+
+        The server is not shut down. It exits by itself `persistence` seconds
+        after the last wine process using the prefix has ended.
+        """
+        self.ready = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class WinePrefixPool(object):
+    """A pool of Wine prefixes to spread the load of many concurrent tasks.
+
+    With many concurrent tasks the wineserver of a single prefix becomes a
+    bottleneck for process creation and file I/O. The pool spreads the worker
+    slots round-robin over a number of prefixes, each with their own
+    wineserver. Prefixes which do not exist are created once as copies
+    of a template prefix.
+
+    Parameters
+    ----------
+    prefixes : int or list of str
+        Either the number of prefixes to use, in which case they are created
+        next to the template prefix (e.g. ``~/.wine_anypytools_0``), or
+        an explicit list of prefix folders.
+    template : str, optional
+        The prefix to copy when creating new prefixes. Defaults to the
+        ``WINEPREFIX`` of the current environment (or ``~/.wine``)
+
+    Examples
+    --------
+    >>> pool = WinePrefixPool(4)
+    >>> pool.create()
+    >>> pool.env(slot=5)["WINEPREFIX"]
+    '/home/user/.wine_anypytools_1'
+
+    """
+
+    def __init__(self, prefixes, template=None):
+        self.template = Path(template) if template else default_wineprefix()
+        if isinstance(prefixes, int):
+            if prefixes < 1:
+                raise ValueError("The number of Wine prefixes must be positive")
+            name = self.template.name
+            prefixes = [
+                self.template.with_name(f"{name}_anypytools_{i}")
+                for i in range(prefixes)
+            ]
+        self.prefixes = [Path(p) for p in prefixes]
+        if not self.prefixes:
+            raise ValueError("At least one Wine prefix is required")
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def __getitem__(self, slot):
+        """Return the prefix assigned to worker `slot`."""
+        return self.prefixes[slot % len(self.prefixes)]
+
+    def create(self):
+        """Create any missing prefixes by copying the template prefix."""
+        for prefix in self.prefixes:
+            if prefix.exists():
+                continue
+            if not self.template.is_dir():
+                raise IOError(f"Wine prefix template does not exist: {self.template}")
+            logger.info(f"Creating Wine prefix {prefix} from {self.template}")
+            shutil.copytree(self.template, prefix, symlinks=True)
+
+    def env(self, slot, base_env=None):
+        """Return the environment for running a task in worker `slot`."""
+        env = dict(os.environ if base_env is None else base_env)
+        env["WINEPREFIX"] = str(self[slot])
+        return env
+
+    def rebase(self, path, slot):
+        """Move a path inside the template prefix to the prefix for `slot`."""
+        path = Path(path)
+        try:
+            relpath = path.absolute().relative_to(self.template.absolute())
+        except ValueError:
+            return path
+        return self[slot] / relpath
+
+    def servers(self, base_env=None):
+        """Return a `WineServer` for each prefix in the pool."""
+        return [WineServer(prefix=prefix, env=base_env) for prefix in self.prefixes]
+
+
+class WinePathTranslator(object):
+    """Translate between Unix and Windows paths without starting Wine.
+
+    The drive mapping is read once from the ``dosdevices`` symlinks
+    of the prefix. The translation mimics the ``winepath`` tool. Methods
+    return None for cases which can not be translated unambiguously
+    (e.g. UNC paths or unknown drives), in which case the caller should
+    fall back to ``winepath``.
+
+    Parameters
+    ----------
+    prefix : str, optional
+        The Wine prefix. Defaults to the ``WINEPREFIX`` of the current environment.
+
+    Examples
+    --------
+    >>> translator = WinePathTranslator()
+    >>> translator.to_windows("/home/user/model/main.any")
+    'Z:\\home\\user\\model\\main.any'
+    >>> translator.to_unix("C:\\Program Files")
+    '/home/user/.wine/drive_c/Program Files'
+
+    """
+
+    def __init__(self, prefix=None):
+        self.prefix = Path(prefix) if prefix else default_wineprefix()
+        self.drives = {}
+        dosdevices = self.prefix / "dosdevices"
+        with suppress(OSError):
+            for entry in sorted(os.scandir(dosdevices), key=lambda e: e.name):
+                name = entry.name.lower()
+                # Skip raw devices (e.g. 'd::') and com/lpt ports
+                if len(name) != 2 or name[1] != ":" or not name[0].isalpha():
+                    continue
+                target = os.path.realpath(entry.path)
+                if os.path.isdir(target):
+                    self.drives[name[0].upper()] = target
+        # Root dirs (in drive letter order) used for unix -> windows lookups
+        self._roots = {}
+        for letter, target in sorted(self.drives.items()):
+            self._roots.setdefault(target, letter)
+
+    def to_windows(self, path):
+        """Translate a Unix path to a Windows path."""
+        path = os.path.realpath(os.path.abspath(str(path)))
+        parent, tail = path, []
+        while True:
+            if parent in self._roots:
+                letter = self._roots[parent]
+                return letter + ":\\" + "\\".join(reversed(tail))
+            head, name = os.path.split(parent)
+            if head == parent:
+                return None
+            tail.append(name)
+            parent = head
+
+    def to_unix(self, path):
+        """Translate a Windows path to a Unix path."""
+        path = str(path).replace("/", "\\")
+        if len(path) < 2 or path[1] != ":" or path.startswith("\\\\"):
+            return None
+        root = self.drives.get(path[0].upper())
+        if root is None:
+            return None
+        current = root
+        parts = [p for p in path[2:].split("\\") if p not in ("", ".")]
+        for i, part in enumerate(parts):
+            if part == "..":
+                current = os.path.dirname(current) if current != root else root
+                continue
+            candidate = os.path.join(current, part)
+            if os.path.exists(candidate):
+                current = candidate
+                continue
+            # Windows paths are case insensitive.
+            try:
+                matches = [e for e in os.listdir(current) if e.lower() == part.lower()]
+            except OSError:
+                matches = []
+            if len(matches) > 1:
+                return None
+            if not matches:
+                # Remaining parts does not exist. Keep them as they are.
+                return os.path.join(current, *parts[i:])
+            current = os.path.join(current, matches[0])
+        return current
+
+
+@functools.lru_cache(maxsize=None)
+def get_path_translator(prefix=None):
+    """Return a cached `WinePathTranslator` for the prefix."""
+    return WinePathTranslator(prefix)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark scanning the include graph of a large model with the include index.
+
+A synthetic model with the given number of files (similar in size to the
+AMMR) is generated in a temporary folder. The model is scanned once without
+an index, and again with the index loaded from disk.
+
+Usage::
+
+    python benchmarks/bench_include_index.py --files 5000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from anypytools.includeindex import IncludeIndex
+
+
+def _create_model(folder, n_files, files_per_folder=50):
+    main_lines = []
+    for group in range(0, n_files, files_per_folder):
+        subfolder = os.path.join(folder, f"Part{group}")
+        os.makedirs(subfolder)
+        main_lines.append(f'#include "<ANYBODY_PATH_AMMR>/Part{group}/Part.any"')
+        includes = []
+        for i in range(files_per_folder):
+            includes.append(f'#include "File{i}.any"')
+            with open(os.path.join(subfolder, f"File{i}.any"), "w") as fh:
+                fh.write("AnyVar Value = 1.0;\n" * 100)
+        with open(os.path.join(subfolder, "Part.any"), "w") as fh:
+            fh.write("\n".join(includes))
+    main_file = os.path.join(folder, "Main.any")
+    with open(main_file, "w") as fh:
+        fh.write('#path ANYBODY_PATH_AMMR "."\n' + "\n".join(main_lines))
+    return main_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--files", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        main_file = _create_model(folder, args.files)
+        index_file = os.path.join(folder, "include_index.json")
+
+        start = time.perf_counter()
+        index = IncludeIndex(index_file)
+        deps = index.scan(main_file)
+        index.save()
+        print(
+            f"Cold scan of {len(deps.files)} files: {time.perf_counter() - start:.3f} s"
+        )
+
+        start = time.perf_counter()
+        index = IncludeIndex(index_file)
+        index.scan(main_file)
+        print(f"Scan with saved index: {time.perf_counter() - start:.3f} s")
+
+        start = time.perf_counter()
+        index.scan(main_file)
+        print(f"Scan with index in memory: {time.perf_counter() - start:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark filtering of errors and warnings with many ignore patterns.
+
+A log with many warnings and errors is generated, together with lists of
+error messages to ignore and warnings to include, as found in large
+regression suites. The lines are matched with one substring test per pattern,
+and with the compiled multi-pattern matcher. Finally the whole log is parsed
+with the filters.
+
+Usage::
+
+    python benchmarks/bench_message_filters.py --lines 20000 --patterns 500
+"""
+
+import argparse
+import random
+import time
+
+from anypytools.tools import _contains_any, _substring_pattern, parse_anybodycon_output
+
+WORDS = [
+    "Kinematic",
+    "analysis",
+    "failed",
+    "Muscle",
+    "Joint",
+    "Segment",
+    "Main.HumanModel",
+    "constraint",
+    "tolerance",
+    "deprecated",
+    "Position",
+    "Velocity",
+]
+
+
+def _phrase(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+def _create_log(rng, n_lines):
+    lines = []
+    for i in range(n_lines):
+        kind = "ERROR" if i % 10 == 0 else "WARNING"
+        lines.append(
+            f"{kind}(OBJ1.{rng.randint(0, 999)}) : C:/model/file{i % 50}.any({i}) : "
+            f"'{_phrase(rng, 2)}' : {_phrase(rng, 8)}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lines", type=int, default=20000)
+    parser.add_argument("--patterns", type=int, default=500)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    raw = _create_log(rng, args.lines)
+    lines = raw.splitlines()
+    patterns = [
+        f"file{rng.randint(0, 49)}.any({rng.randint(0, args.lines)})"
+        for _ in range(args.patterns)
+    ]
+
+    start = time.perf_counter()
+    matches = sum(_contains_any(line, patterns) for line in lines)
+    print(f"Substring tests: {time.perf_counter() - start:.3f} s ({matches} matches)")
+
+    start = time.perf_counter()
+    pattern = _substring_pattern(tuple(patterns))
+    print(f"Compiling the matcher: {time.perf_counter() - start:.3f} s")
+
+    start = time.perf_counter()
+    matches = sum(bool(pattern.search(line)) for line in lines)
+    print(
+        f"Multi-pattern matcher: {time.perf_counter() - start:.3f} s ({matches} matches)"
+    )
+
+    start = time.perf_counter()
+    parse_anybodycon_output(
+        raw, errors_to_ignore=patterns, warnings_to_include=patterns[::2]
+    )
+    print(f"Parsing the log with filters: {time.perf_counter() - start:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark parsing of dumped AnyScript values.
+
+A matrix of random numbers (with a few nan and inf values) is formatted as
+AnyBodyCon prints it, and parsed with the fast numeric parser and with the
+``ast.literal_eval`` based parser.
+
+Usage::
+
+    python benchmarks/bench_parse_data.py --rows 1000 --cols 300
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from anypytools.tools import _parse_data, _parse_data_literal
+
+
+def _anyscript_matrix(rows, cols):
+    data = np.random.default_rng(0).normal(size=(rows, cols))
+    data.flat[::97] = np.nan
+    data.flat[::101] = np.inf
+    return (
+        "{"
+        + ", ".join("{" + ", ".join(f"{v:.7g}" for v in row) + "}" for row in data)
+        + "}"
+    )
+
+
+def _time(func, value, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(value)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--cols", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    value = _anyscript_matrix(args.rows, args.cols)
+    fast = _time(_parse_data, value, args.repeat)
+    literal = _time(_parse_data_literal, value, args.repeat)
+    print(f"Parsing a {args.rows}x{args.cols} matrix ({len(value) / 1e6:.1f} MB)")
+    print(f"Fast numeric parser: {fast:.3f} s")
+    print(f"literal_eval parser: {literal:.3f} s ({literal / fast:.0f}x slower)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the peak memory of parsing a large AnyBodyCon log file.
+
+A log with several large dumped matrices is written to a temporary folder.
+The log is parsed from its content (read into one string), and from its path,
+where the file is memory mapped and scanned one line at a time. Finally the
+log is followed while it is written, as `AnyPyProcess` does when AnyBody
+runs, and parsed incrementally. This is done both while the log is written,
+and in one go for a log which was written before the follower polled it.
+
+Usage::
+
+    python benchmarks/bench_parse_logfile.py --variables 20 --values 200000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from anypytools.abcutils import _LogFollower
+from anypytools.tools import AnyBodyConLogParser, parse_anybodycon_output
+
+
+def _write_log(filename, n_variables, n_values):
+    row = "{" + ", ".join(["0.123456789"] * 10) + "}"
+    value = "{" + ", ".join([row] * (n_values // 10)) + "}"
+    with open(filename, "w") as fh:
+        for i in range(n_variables):
+            fh.write(f'#### Macro command > classoperation Main.Var{i} "Dump"\n')
+            fh.write(f"Main.Var{i} = {value};\n")
+            fh.write("Elapsed Time : 0.015000\n")
+
+
+def _measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--variables", type=int, default=20)
+    parser.add_argument("--values", type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        logfile = Path(folder) / "log.txt"
+        _write_log(logfile, args.variables, args.values)
+        size = os.path.getsize(logfile)
+        print(f"Log file of {size / 1e6:.0f} MB")
+
+        def from_content():
+            with open(logfile) as fh:
+                parse_anybodycon_output(fh.read())
+
+        def from_path():
+            parse_anybodycon_output(logfile)
+
+        def while_written():
+            growing = Path(folder) / "growing.txt"
+            parser = AnyBodyConLogParser()
+            follower = _LogFollower(str(growing), [parser])
+            with open(logfile, "rb") as src, open(growing, "wb") as dst:
+                for block in iter(lambda: src.read(2**18), b""):
+                    dst.write(block)
+                    dst.flush()
+                    follower.check()
+            follower.close()
+            parser.finish()
+
+        def after_exit():
+            # The whole log is written before the follower polls the file
+            parser = AnyBodyConLogParser()
+            _LogFollower(str(logfile), [parser]).close()
+            parser.finish()
+
+        for name, func in [
+            ("From content", from_content),
+            ("From path", from_path),
+            ("Follower, while written", while_written),
+            ("Follower, after exit", after_exit),
+        ]:
+            elapsed, peak = _measure(func)
+            print(f"{name}: {elapsed:.2f} s, peak memory {peak / 1e6:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
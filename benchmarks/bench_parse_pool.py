@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark parsing many log files in threads and in a process pool.
+
+Log files with large dumped matrices are generated in a temporary folder,
+and parsed at the same time by a number of threads, as when many tasks end
+together. The logs are parsed in the threads themselves, and by sending them
+to a process pool. A heartbeat thread, which stands in for the progress
+display, measures the longest time it had to wait for the GIL.
+
+Usage::
+
+    python benchmarks/bench_parse_pool.py --logs 64 --rows 200 --cols 300
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from anypytools.tools import (
+    _load_parsed_logfile,
+    _parse_logfile_in_worker,
+    get_ncpu,
+    parse_anybodycon_output,
+)
+
+
+def _create_log(filename, rows, cols, seed):
+    data = np.random.default_rng(seed).normal(size=(rows, cols))
+    value = (
+        "{"
+        + ", ".join("{" + ", ".join(f"{v:.7g}" for v in row) + "}" for row in data)
+        + "}"
+    )
+    with open(filename, "w") as fh:
+        for i in range(5):
+            fh.write(f'#### Macro command > classoperation Main.Out{i} "Dump"\n')
+            fh.write(f"Main.Out{i} = {value};\n")
+
+
+class _Heartbeat(threading.Thread):
+    """Thread which wakes up every millisecond and records the longest delay."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.max_delay = 0.0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            start = time.perf_counter()
+            time.sleep(0.001)
+            self.max_delay = max(self.max_delay, time.perf_counter() - start)
+
+
+def _timed(name, func, logfiles, threads):
+    heartbeat = _Heartbeat()
+    heartbeat.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(func, logfiles))
+    elapsed = time.perf_counter() - start
+    heartbeat.running = False
+    heartbeat.join()
+    print(
+        f"{name}: {elapsed:.3f} s (longest heartbeat delay {heartbeat.max_delay:.3f} s)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--logs", type=int, default=64)
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--cols", type=int, default=300)
+    parser.add_argument("--processes", type=int, default=get_ncpu())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        logfiles = [os.path.join(folder, f"log{i}.txt") for i in range(args.logs)]
+        for i, logfile in enumerate(logfiles):
+            _create_log(logfile, args.rows, args.cols, i)
+
+        _timed(
+            "Parsing in threads",
+            lambda logfile: parse_anybodycon_output(Path(logfile)),
+            logfiles,
+            args.logs,
+        )
+
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(args.processes, mp_context=context) as pool:
+            # Start the worker processes before timing
+            list(pool.map(abs, range(args.processes)))
+
+            def parse_in_pool(logfile):
+                future = pool.submit(_parse_logfile_in_worker, logfile, {})
+                return _load_parsed_logfile(*future.result())
+
+            _timed(
+                f"Parsing in {args.processes} processes",
+                parse_in_pool,
+                logfiles,
+                args.logs,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the per-task startup overhead of Wine with and without
+a persistent wineserver.
+
+Each "task" is a trivial ``wine cmd /c exit`` which is the same wrapper
+AnyPyTools uses to launch AnyBodyCon on Linux. Without a persistent
+server the wineserver is shut down between tasks, which is what happens
+when tasks are further apart than the default wineserver linger time.
+
+Usage::
+
+    python benchmarks/bench_wine_startup.py --tasks 10
+"""
+
+import argparse
+import statistics
+import subprocess
+import time
+
+from anypytools.wineutils import WineServer
+
+
+def _run_task():
+    start = time.perf_counter()
+    subprocess.run(
+        ["wine", "cmd", "/c", "exit"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        check=False,
+    )
+    return time.perf_counter() - start
+
+
+def _shutdown_wineserver():
+    subprocess.run(["wineserver", "-k"], check=False, stderr=subprocess.DEVNULL)
+    subprocess.run(["wineserver", "-w"], check=False, stderr=subprocess.DEVNULL)
+
+
+def bench_cold(n_tasks):
+    timings = []
+    for _ in range(n_tasks):
+        _shutdown_wineserver()
+        timings.append(_run_task())
+    return timings
+
+
+def bench_persistent(n_tasks):
+    _shutdown_wineserver()
+    start = time.perf_counter()
+    with WineServer():
+        warmup = time.perf_counter() - start
+        timings = [_run_task() for _ in range(n_tasks)]
+    return warmup, timings
+
+
+def _report(label, timings):
+    print(
+        f"{label:<22} mean: {statistics.mean(timings):7.3f} s"
+        f"  median: {statistics.median(timings):7.3f} s"
+        f"  max: {max(timings):7.3f} s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tasks", type=int, default=10)
+    args = parser.parse_args()
+
+    _report("Without wineserver", bench_cold(args.tasks))
+    warmup, timings = bench_persistent(args.tasks)
+    print(f"Persistent wineserver startup (once per batch): {warmup:.3f} s")
+    _report("Persistent wineserver", timings)
+
+
+if __name__ == "__main__":
+    main()
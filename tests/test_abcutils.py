@@ -4,8 +4,10 @@ Created on Sun Jul 06 19:09:58 2014
 
 @author: Morten
 """
+
 import os
 import shutil
+import sys
 import pytest
 import pathlib
 
@@ -90,6 +92,21 @@ class TestAnyPyProcess:
         assert "ERROR" not in output[1]
         assert "ERROR" in output[2]
 
+    @pytest.mark.parametrize("preflight", ["task", "load"])
+    def test_preflight_skips_failing_model(self, init_simple_model, preflight):
+        app = AnyPyProcess(silent=True, preflight=preflight)
+        macro = [
+            ['load "not_a_model.any"', "operation Main.ArmModelStudy.InverseDynamics"],
+            ['load "model.main.any"', "operation Main.ArmModelStudy.InverseDynamics"],
+            ['load "not_a_model.any"', "operation Main.ArmModelStudy.InverseDynamics"],
+        ]
+
+        output = app.start_macro(macro)
+
+        assert "ERROR" not in output[1]
+        assert "Skipped" in output[2]["ERROR"][0]
+        assert output[2]["task_processtime"] == 0
+
     def test_start_macro(self, init_simple_model, default_macro):
         app = AnyPyProcess(silent=True)
 
@@ -296,6 +313,343 @@ class TestAnyPyProcess:
         assert df.index.name == None
 
 
+def test_stall_watchdog_kills_silent_process(tmpdir):
+    import subprocess
+    import sys
+
+    from anypytools.abcutils import (
+        _STALLED_BY_ANYPYTOOLS,
+        _StallWatchdog,
+        _wait_for_process,
+    )
+
+    logfile = tmpdir.join("log.txt")
+    logfile.write("some output")
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    watchdog = _StallWatchdog(str(logfile), proc.pid, stall_timeout=0.3)
+    retcode = _wait_for_process(
+        proc, timeout=20, monitors=[watchdog], poll_interval=0.1
+    )
+    assert retcode == _STALLED_BY_ANYPYTOOLS
+    assert proc.poll() is not None
+
+
+def test_stall_watchdog_warns_once_without_psutil(tmpdir, monkeypatch, caplog):
+    import sys
+
+    from anypytools import abcutils
+
+    monkeypatch.setitem(sys.modules, "psutil", None)
+    monkeypatch.setattr(abcutils, "_psutil_warned", False)
+    logfile = tmpdir.join("log.txt")
+    logfile.write("some output")
+    with caplog.at_level("WARNING", logger="abt.anypytools"):
+        abcutils._StallWatchdog(str(logfile), 1, stall_timeout=10)
+        abcutils._StallWatchdog(str(logfile), 2, stall_timeout=10)
+    messages = [r.message for r in caplog.records if "psutil" in r.message]
+    assert len(messages) == 1
+
+
+def test_abort_on_first_fatal_error(tmpdir):
+    import subprocess
+    import sys
+
+    from anypytools.abcutils import (
+        _ABORTED_BY_ANYPYTOOLS,
+        _FatalErrorDetector,
+        _LogFollower,
+        _wait_for_process,
+    )
+
+    logfile = tmpdir.join("log.txt")
+    script = (
+        "import sys, time\n"
+        "with open(sys.argv[1], 'a') as fh:\n"
+        "    fh.write('ERROR(OBJ.MCH.KIN3) : ignore me\\n')\n"
+        "    fh.flush()\n"
+        "    time.sleep(0.5)\n"
+        "    fh.write('ERROR : Model loading failed\\n')\n"
+        "    fh.flush()\n"
+        "    time.sleep(30)\n"
+    )
+    proc = subprocess.Popen([sys.executable, "-c", script, str(logfile)])
+    detector = _FatalErrorDetector(errors_to_ignore=["KIN3"])
+    follower = _LogFollower(str(logfile), [detector])
+    retcode = _wait_for_process(
+        proc, timeout=20, monitors=[follower], poll_interval=0.1
+    )
+    assert retcode == _ABORTED_BY_ANYPYTOOLS
+    assert detector.error == "ERROR : Model loading failed"
+
+
+def test_adaptive_timeout(tmpdir):
+    from anypytools.abcutils import AdaptiveTimeout, Task
+
+    history_file = str(tmpdir.join("runtimes.json"))
+    timeouts = AdaptiveTimeout(history_file, safety_factor=2, min_timeout=10)
+    task = Task(folder=str(tmpdir), macro=['load "model.main.any"', "run"])
+    # Not enough samples yet
+    assert timeouts.timeout(task, default=3600) == 3600
+    for runtime in [20, 21, 22, 23, 24]:
+        task.processtime = runtime
+        timeouts.record(task)
+    assert 2 * 23 < timeouts.timeout(task, default=3600) <= 2 * 24
+    # Failed tasks are not recorded
+    task.add_error("ERROR: Failed")
+    task.processtime = 1000
+    timeouts.record(task)
+    assert timeouts.timeout(task, default=3600) <= 2 * 24
+    # Values are clipped to the range
+    assert timeouts.timeout(task, default=30) == 30
+
+    timeouts.save()
+    reloaded = AdaptiveTimeout(history_file, safety_factor=2, min_timeout=10)
+    other_task = Task(folder=str(tmpdir), macro=['load "model.main.any"', "exit"])
+    assert reloaded.timeout(other_task, default=3600) == timeouts.timeout(
+        task, default=3600
+    )
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="Tests the Wine setup")
+def test_adaptive_timeout_of_task_without_load(tmpdir, monkeypatch):
+    import subprocess
+
+    from anypytools import abcutils
+    from anypytools.abcutils import AdaptiveTimeout, Task
+
+    monkeypatch.setattr(abcutils, "winepath", lambda path, *args, **kwargs: path)
+    monkeypatch.setattr(
+        abcutils,
+        "Popen",
+        lambda cmd, **kwargs: subprocess.Popen([sys.executable, "-c", "pass"]),
+    )
+    anybodycon = tmpdir.join("anybodycon.exe")
+    anybodycon.write("")
+    timeouts = AdaptiveTimeout(min_samples=1, min_timeout=1, safety_factor=2)
+    macro = ['classoperation Main.Model.Var "Dump"']
+    task = Task(folder=str(tmpdir), macro=macro)
+    with open(str(tmpdir.join("log.txt")), "w+") as logfile:
+        abcutils.execute_anybodycon(
+            task.macro,
+            logfile=logfile,
+            anybodycon_path=pathlib.Path(str(anybodycon)),
+            folder=str(tmpdir),
+        )
+    assert task.macro[-1] == "exit"
+    task.processtime = 10
+    timeouts.record(task)
+    new_task = Task(folder=str(tmpdir), macro=list(macro[:-1]))
+    assert timeouts.timeout(new_task, default=3600) == 20
+
+
+def test_fused_macro_log_is_split_per_task():
+    from anypytools.abcutils import _fuse_macros, _split_fused_log
+    from anypytools.tools import parse_anybodycon_output
+
+    macros = [
+        ['load "main.any"', f'classoperation Main.a "Set Value" --value={i}', "exit"]
+        for i in range(3)
+    ]
+    fused = _fuse_macros(macros, "values.anyset")
+    assert fused[0] == 'load "main.any"'
+    assert sum(cmd.startswith("load ") for cmd in fused) == 1
+    assert "exit" not in fused
+    log = (
+        "\n".join(fused)
+        + "\n#### Macro command > load\nLoading model\n"
+        + '#### Macro command > print "#### ANYPYTOOLS TASK BLOCK: 0"\n'
+        + "#### ANYPYTOOLS TASK BLOCK: 0\nblock 0 output\n"
+        + "#### ANYPYTOOLS TASK BLOCK: 1\nERROR : block 1 failed\n"
+    )
+    preamble, blocks = _split_fused_log(log, 3)
+    assert "Loading model" in preamble
+    assert "block 0" not in preamble
+    assert blocks[0].strip() == "block 0 output"
+    assert blocks[1].strip() == "ERROR : block 1 failed"
+    assert blocks[2] is None
+    assert "ERROR" not in parse_anybodycon_output(preamble + blocks[0])
+    assert "ERROR" in parse_anybodycon_output(preamble + blocks[1])
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="Tests the Wine setup")
+def test_fused_worker_uses_slot_prefix_and_adaptive_timeouts(tmpdir, monkeypatch):
+    from queue import Queue
+
+    from anypytools import abcutils
+    from anypytools.abcutils import AdaptiveTimeout, Task
+
+    anybodycon = tmpdir.join("anybodycon.exe")
+    anybodycon.write("")
+    adaptive = AdaptiveTimeout(min_timeout=1, min_samples=1)
+    app = AnyPyProcess(
+        anybodycon_path=str(anybodycon),
+        silent=True,
+        timeout=3600,
+        fuse_tasks=2,
+        wine_prefixes=[str(tmpdir.join("prefix0")), str(tmpdir.join("prefix1"))],
+        adaptive_timeout=adaptive,
+    )
+    tasks = [
+        Task(folder=str(tmpdir), macro=['load "a.any"', "run"]),
+        Task(folder=str(tmpdir), macro=['load "b.any"', "run"]),
+    ]
+    adaptive.runtimes[adaptive.key(tasks[0])] = [10.0]
+    prefixes, timeouts = [], []
+    monkeypatch.setattr(
+        abcutils,
+        "winepath",
+        lambda path, opts=None, prefix=None: prefixes.append(prefix) or path,
+    )
+
+    def run_task(task, slot, timeout, log_consumers=None, read_log=True):
+        timeouts.append(timeout)
+        return ""
+
+    monkeypatch.setattr(app, "_run_task", run_task)
+    app._fused_worker(tasks, Queue(), slot=1)
+    assert prefixes == [str(tmpdir.join("prefix1"))]
+    assert [task.timeout for task in tasks] == [30.0, 3600]
+    assert timeouts == [3630.0]
+
+
+def test_circuit_breaker():
+    from anypytools.abcutils import CircuitBreaker, Task
+
+    def finished_task(error=None):
+        task = Task(macro=['load "model.main.any"'])
+        if error:
+            task.add_error(error)
+        return task
+
+    breaker = CircuitBreaker(max_failures=2, max_failure_rate=None)
+    assert not breaker.record(finished_task("ERROR : Model loading failed"))
+    assert not breaker.record(finished_task("ERROR : Other error"))
+    assert not breaker.record(finished_task("ERROR : Model loading failed\n more"))
+    assert breaker.record(finished_task("ERROR : Model loading failed"))
+    assert "3 tasks failed with: ERROR : Model loading failed" in breaker.reason
+    breaker.reset()
+    assert not breaker.tripped
+
+    breaker = CircuitBreaker(max_failure_rate=0.5, window=4)
+    for _ in range(2):
+        assert not breaker.record(finished_task())
+        assert not breaker.record(finished_task("ERROR : Failed"))
+    assert breaker.record(finished_task("ERROR : Failed"))
+    assert "3 of the last 4 tasks" in breaker.reason
+
+
+def test_load_phase_detector():
+    from anypytools.abcutils import _LoadPhaseDetector
+
+    logfile = os.path.join(os.path.dirname(__file__), "data", "anybodycon_output.txt")
+    with open(logfile) as fh:
+        lines = fh.read().splitlines()
+    end_of_load = lines.index("## Loading finished successfully.")
+
+    detector = _LoadPhaseDetector()
+    detector.feed(lines[:end_of_load])
+    assert detector.loading
+    detector.feed(lines[end_of_load:])
+    assert not detector.loading
+
+    # Without the end marker, the next macro command ends the load phase
+    released = []
+    detector = _LoadPhaseDetector(on_loaded=lambda: released.append(True))
+    detector.feed([l for l in lines if not l.startswith("## Loading finished")])
+    assert not detector.loading
+    detector.done()
+    assert released == [True]
+
+
+@pytest.mark.parametrize("chunk_size", [2**20, 7])
+def test_log_follower_feeds_the_whole_log(tmpdir, chunk_size):
+    from anypytools.abcutils import _LogFollower
+    from anypytools.tools import AnyBodyConLogParser, parse_anybodycon_output
+
+    testfile = os.path.join(os.path.dirname(__file__), "data", "anybodycon_output.txt")
+    with open(testfile) as fh:
+        raw = fh.read().rstrip("\n")
+    logfile = str(tmpdir.join("log.txt"))
+    parser = AnyBodyConLogParser()
+    follower = _LogFollower(logfile, [parser])
+    follower.chunk_size = chunk_size
+    half = raw.index("Main.SomeMatrix") + 20
+    with open(logfile, "w", newline="\r\n") as fh:
+        fh.write(raw[:half])
+        fh.flush()
+        follower.check()
+        assert "Main.MyOutput2" in parser.output
+        assert "Main.SomeMatrix" not in parser.output
+        # The last line has no line ending
+        fh.write(raw[half:])
+    follower.close()
+    output = parser.finish()
+    assert list(output) == list(parse_anybodycon_output(raw))
+    assert output["number"] == 123
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="Tests the Wine setup")
+def test_timeout_message_after_appended_output(tmpdir, monkeypatch):
+    import subprocess
+
+    from anypytools import abcutils
+    from anypytools.tools import AnyBodyConLogParser
+
+    # AnyBody appends to the log through its own file handle on Linux/Wine
+    logfile_name = str(tmpdir.join("log.txt"))
+    script = (
+        "import sys, time\n"
+        "with open(sys.argv[1], 'a') as fh:\n"
+        "    fh.write('\\nMain.Out = {1.0, 2.0};\\n' * 20)\n"
+        "time.sleep(30)\n"
+    )
+    monkeypatch.setattr(abcutils, "winepath", lambda path, *args, **kwargs: path)
+    monkeypatch.setattr(
+        abcutils,
+        "Popen",
+        lambda cmd, **kwargs: subprocess.Popen(
+            [sys.executable, "-c", script, logfile_name]
+        ),
+    )
+    anybodycon = tmpdir.join("anybodycon.exe")
+    anybodycon.write("")
+    parser = AnyBodyConLogParser()
+    with open(logfile_name, "w+") as logfile:
+        logfile.write("########### MACRO #############\n")
+        logfile.flush()
+        retcode = abcutils.execute_anybodycon(
+            ['load "main.any"'],
+            logfile=logfile,
+            anybodycon_path=pathlib.Path(str(anybodycon)),
+            timeout=2,
+            folder=str(tmpdir),
+            log_consumers=[parser],
+        )
+    assert retcode == abcutils._TIMEDOUT_BY_ANYPYTOOLS
+    output = parser.finish()
+    assert output["ERROR"] == ["ERROR: AnyPyTools : Timeout after 2 sec."]
+    assert tmpdir.join("log.txt").read().count("Main.Out = {1.0, 2.0};") == 20
+
+
+def test_remove_skipped_lines_from_log(tmpdir):
+    from anypytools.abcutils import _remove_lines
+    from anypytools.tools import AnyBodyConLogParser, parse_anybodycon_output
+
+    testfile = os.path.join(os.path.dirname(__file__), "data", "anybodycon_output.txt")
+    logfile = tmpdir.join("log.txt")
+    logfile.write(open(testfile).read())
+    keep = ["Main.MyOutput*", "hello"]
+    parser = AnyBodyConLogParser(keep=keep)
+    parser.feed(logfile.read().split("\n"))
+    output = parser.finish()
+
+    _remove_lines(str(logfile), parser.skipped_lines)
+    trimmed = logfile.read()
+    assert "Main.SomeMatrix" not in trimmed.replace("print Main.SomeMatrix", "")
+    assert "Macro command > print Main.SomeMatrix" in trimmed
+    assert list(parse_anybodycon_output(trimmed)) == list(output)
+
+
 if __name__ == "__main__":
     os.chdir(pathlib.Path(__file__).parent)
     pytest.main(
@@ -0,0 +1,138 @@
+import os
+
+import pytest
+
+from anypytools.includeindex import IncludeIndex, parse_load_command
+
+MAIN_FILE = """\
+#include "libdef.any"
+// #include "commented.any"
+#ifndef BM_ARM
+  #define BM_ARM 1
+#endif
+Main = {
+  #include "<ANYBODY_PATH_BODY>/BodyModel.any"
+  /* #include "also_commented.any" */
+  #if BM_ARM == 0
+    #include "no_arm.any"
+  #else
+    #include "arm.any"
+  #endif
+  #ifdef EXTRA
+  #include "extra.any"
+  #endif
+  #if UNKNOWN_DEFINE > 2
+    #include "maybe.any"
+  #endif
+  #include "<UNKNOWN_PATH>/other.any"
+};
+"""
+
+
+@pytest.fixture()
+def model(tmpdir):
+    tmpdir.mkdir("model").join("main.any").write(MAIN_FILE)
+    tmpdir.join("model", "libdef.any").write(
+        '#path ANYBODY_PATH_AMMR "../ammr"\n'
+        '#path ANYBODY_PATH_BODY "<ANYBODY_PATH_AMMR>/Body"\n'
+    )
+    tmpdir.mkdir("ammr").mkdir("Body").join("BodyModel.any").write(
+        '#include "../Tools/tool.any"\n'
+    )
+    tmpdir.join("ammr").mkdir("Tools").join("tool.any").write("// Tool")
+    for name in ["arm", "no_arm", "extra", "maybe"]:
+        tmpdir.join("model", name + ".any").write(f"// {name}")
+    return tmpdir
+
+
+def _names(deps, root):
+    return sorted(
+        os.path.relpath(str(f), str(root)).replace("\\", "/") for f in deps.files
+    )
+
+
+def test_scan_resolves_includes(model):
+    deps = IncludeIndex().scan(str(model.join("model", "main.any")))
+    assert _names(deps, model) == [
+        "ammr/Body/BodyModel.any",
+        "ammr/Tools/tool.any",
+        "model/arm.any",
+        "model/libdef.any",
+        "model/main.any",
+        # Branches which can not be evaluated are included
+        "model/maybe.any",
+    ]
+    assert deps.unresolved == ["<UNKNOWN_PATH>/other.any"]
+
+
+def test_scan_with_defines(model):
+    index = IncludeIndex()
+    main_file = str(model.join("model", "main.any"))
+    deps = index.scan(main_file)
+    deps_with_defs = index.scan(main_file, defs={"BM_ARM": "0", "EXTRA": ""})
+    assert "model/no_arm.any" in _names(deps_with_defs, model)
+    assert "model/extra.any" in _names(deps_with_defs, model)
+    assert "model/arm.any" not in _names(deps_with_defs, model)
+    assert deps.digest != deps_with_defs.digest
+
+
+@pytest.mark.parametrize(
+    "expr, expected",
+    [
+        ("N / 2 == 1", True),
+        ("-7 / 2 == -3 && -7 % 2 == -1", True),
+        ("(N + 1) * 2 > 7 || !defined(N)", True),
+        ("N > 3", False),
+        ("N / 0", None),
+        ("9**9**9**9", None),
+        ("N == 1.5", None),
+        ("UNKNOWN_DEFINE", None),
+    ],
+)
+def test_if_expressions(expr, expected):
+    from anypytools.includeindex import _Scan
+
+    scan = _Scan(IncludeIndex(), "main.any", {"N": "3"}, {})
+    assert scan.evaluate(expr) == expected
+
+
+def test_file_included_with_other_defines(model):
+    model.join("model", "side.any").write(
+        '#if SIDE == 1\n#include "right.any"\n#else\n#include "left.any"\n#endif\n'
+    )
+    for name in ["right", "left"]:
+        model.join("model", name + ".any").write(f"// {name}")
+    model.join("model", "both.any").write(
+        '#define SIDE 1\n#include "side.any"\n#undef SIDE\n'
+        '#define SIDE 2\n#include "side.any"\n'
+    )
+    deps = IncludeIndex().scan(str(model.join("model", "both.any")))
+    assert _names(deps, model) == [
+        "model/both.any",
+        "model/left.any",
+        "model/right.any",
+        "model/side.any",
+    ]
+
+
+def test_index_is_persisted_and_tracks_changes(model):
+    index_file = str(model.join("index.json"))
+    main_file = str(model.join("model", "main.any"))
+    index = IncludeIndex(index_file)
+    digest = index.scan(main_file).digest
+    index.save()
+
+    reloaded = IncludeIndex(index_file)
+    assert len(reloaded.entries) == len(index.entries)
+    assert reloaded.scan(main_file).digest == digest
+
+    model.join("ammr", "Tools", "tool.any").write("// A changed tool file")
+    assert reloaded.scan(main_file).digest != digest
+
+
+def test_parse_load_command():
+    assert parse_load_command(
+        'load "main.any" -def N_STEP="20" -def NAME=---"\\"text\\"" '
+        '-p DATA=---"c:\\\\data"'
+    ) == ("main.any", {"N_STEP": "20", "NAME": '"text"'}, {"DATA": "c:\\data"})
+    assert parse_load_command("operation Main.Study.Kinematics") is None
@@ -0,0 +1,180 @@
+import re
+
+import numpy as np
+import pytest
+
+from anypytools import AnyMacro
+from anypytools.macro_commands import Dump, Load, OperationRun, SetValue
+from anypytools.optimization import AnyBodyObjective, finite_difference_jacobian
+from anypytools.tools import AnyPyProcessOutput, AnyPyProcessOutputList
+
+SET_VALUE_PATTERN = re.compile(r'classoperation (\S+) "Set Value" --value="(.*)"')
+
+
+class FakeApp:
+    """Evaluates f(a, b) = [a**2 * b, sin(b)] instead of running AnyBody."""
+
+    def __init__(self):
+        self.macros = []
+
+    def start_macro(self, macrolist, folderlist=None):
+        self.macros.extend(macrolist)
+        results = []
+        for i, macro in enumerate(macrolist):
+            values = dict(
+                SET_VALUE_PATTERN.match(cmd).groups()
+                for cmd in macro
+                if SET_VALUE_PATTERN.match(cmd)
+            )
+            a, b = float(values["Main.a"]), float(values.get("Main.b", 0))
+            out = AnyPyProcessOutput()
+            out["Main.Study.Output.f"] = np.array([a**2 * b, np.sin(b)])
+            out["task_name"] = f"task-{i}"
+            results.append(out)
+        return AnyPyProcessOutputList(results)
+
+
+@pytest.fixture()
+def base_macro():
+    return AnyMacro(
+        Load("model.main.any"),
+        OperationRun("Main.Study.Kinematics"),
+        Dump("Main.Study.Output.f"),
+    )
+
+
+@pytest.mark.parametrize("scheme, n_macros", [("forward", 3), ("central", 4)])
+def test_finite_difference_jacobian(base_macro, scheme, n_macros):
+    app = FakeApp()
+    a, b = 2.0, 0.5
+    jac = finite_difference_jacobian(
+        app,
+        base_macro,
+        [SetValue("Main.a", a), SetValue("Main.b", b)],
+        ["f"],
+        steps=[1e-6, 1e-5],
+        scheme=scheme,
+    )
+    expected = np.array([[2 * a * b, a**2], [0, np.cos(b)]])
+    assert len(app.macros) == n_macros
+    assert all(macro[0] == 'load "model.main.any"' for macro in app.macros)
+    np.testing.assert_allclose(jac, expected, rtol=1e-4, atol=1e-8)
+
+
+def test_finite_difference_jacobian_replaces_variables_in_macro(base_macro):
+    app = FakeApp()
+    var = SetValue("Main.a", 1.0)
+    base_macro.insert(1, var)
+    base_macro.insert(2, SetValue("Main.b", 0.0))
+    finite_difference_jacobian(app, base_macro, [var], ["f"], steps=0.5)
+    set_a = [cmd for cmd in app.macros[1] if "Main.a" in cmd]
+    assert set_a == ['classoperation Main.a "Set Value" --value="1.5"']
+    # The base macro is not modified
+    assert base_macro[1] is var
+
+
+def test_finite_difference_jacobian_reports_errors(base_macro):
+    class FailingApp(FakeApp):
+        def start_macro(self, macrolist, folderlist=None):
+            results = super().start_macro(macrolist, folderlist)
+            results[1]["ERROR"] = ["ERROR : Kinematic analysis failed"]
+            return results
+
+    with pytest.raises(RuntimeError, match="Kinematic analysis failed"):
+        finite_difference_jacobian(
+            FailingApp(), base_macro, [SetValue("Main.a", 1.0)], ["f"]
+        )
+
+
+def test_objective_caches_and_batches(base_macro):
+    app = FakeApp()
+    objective = AnyBodyObjective(app, base_macro, ["Main.a", "Main.b"], "f")
+    np.testing.assert_allclose(objective([2.0, 0.5]), [2.0, np.sin(0.5)])
+    objective([2.0, 0.5 + 1e-13])
+    assert len(app.macros) == 1
+
+    values = objective.evaluate([[1.0, 1.0], [2.0, 0.5], [1.0, 1.0], [3.0, 1.0]])
+    # Only the two new unique points are run, in one batch
+    assert len(app.macros) == 3
+    assert objective.n_evaluations == 3
+    np.testing.assert_allclose(values[3], [9.0, np.sin(1.0)])
+
+
+def test_objective_failure_value(base_macro):
+    class FailingApp(FakeApp):
+        def start_macro(self, macrolist, folderlist=None):
+            results = super().start_macro(macrolist, folderlist)
+            for result in results:
+                result["ERROR"] = ["ERROR : Failed"]
+            return results
+
+    objective = AnyBodyObjective(FailingApp(), base_macro, ["Main.a"], ["f"])
+    with pytest.raises(RuntimeError):
+        objective([1.0])
+    objective = AnyBodyObjective(
+        FailingApp(), base_macro, ["Main.a"], ["f"], failure_value=np.inf
+    )
+    assert objective([1.0]) == np.inf
+    objective = AnyBodyObjective(
+        FailingApp(),
+        base_macro,
+        ["Main.a"],
+        ["f"],
+        failure_value=np.inf,
+        output_shape=(2,),
+    )
+    np.testing.assert_array_equal(objective([1.0]), [np.inf, np.inf])
+
+
+def test_objective_retries_failures_with_the_output_shape(base_macro):
+    class FlakyApp(FakeApp):
+        fail = False
+
+        def start_macro(self, macrolist, folderlist=None):
+            results = super().start_macro(macrolist, folderlist)
+            if self.fail:
+                for result in results:
+                    result["ERROR"] = ["ERROR : No license available"]
+            return results
+
+    app = FlakyApp()
+    objective = AnyBodyObjective(
+        app, base_macro, ["Main.a", "Main.b"], "f", failure_value=np.inf
+    )
+    objective([1.0, 1.0])
+    app.fail = True
+    # The failure value has the shape of the successful outputs
+    np.testing.assert_array_equal(objective([2.0, 1.0]), [np.inf, np.inf])
+    app.fail = False
+    # Failed points are evaluated again
+    np.testing.assert_allclose(objective([2.0, 1.0]), [4.0, np.sin(1.0)])
+    assert objective.n_evaluations == 3
+
+
+def test_objective_as_workers_map(base_macro):
+    from scipy.optimize import differential_evolution
+
+    class ScalarApp(FakeApp):
+        def start_macro(self, macrolist, folderlist=None):
+            self.batches = getattr(self, "batches", 0) + 1
+            results = super().start_macro(macrolist, folderlist)
+            for result in results:
+                a, b = result["Main.Study.Output.f"]
+                result["Main.Study.Output.f"] = (a - 1) ** 2 + b**2
+            return results
+
+    app = ScalarApp()
+    objective = AnyBodyObjective(app, base_macro, ["Main.a", "Main.b"], "f")
+    result = differential_evolution(
+        objective,
+        bounds=[(-2, 2), (0, 1)],
+        workers=objective.map,
+        updating="deferred",
+        maxiter=5,
+        popsize=5,
+        polish=False,
+        seed=1,
+    )
+    assert result.nfev == objective.n_evaluations
+    # Each generation is evaluated as one batch
+    assert app.batches <= 6
@@ -0,0 +1,90 @@
+import os
+import time
+
+import pytest
+
+from anypytools.abcutils import AnyPyProcess, Task
+from anypytools.resultcache import ResultCache, model_digest, stable_digest
+
+
+@pytest.fixture()
+def model(tmpdir):
+    tmpdir.join("model.main.any").write('#include "body.any"\nMain = {};')
+    tmpdir.join("body.any").write("AnyVar a = 1;")
+    return tmpdir
+
+
+def test_stable_digest():
+    assert stable_digest(["load", {"b": 1, "a": 2}]) == stable_digest(
+        ["load", {"a": 2, "b": 1}]
+    )
+    assert stable_digest([1, 2]) != stable_digest([2, 1])
+
+
+def test_model_digest_follows_includes(model):
+    digest = model_digest(str(model.join("model.main.any")))
+    assert digest == model_digest(str(model.join("model.main.any")))
+    model.join("body.any").write("AnyVar a = 2;")
+    assert digest != model_digest(str(model.join("model.main.any")))
+    assert model_digest(str(model.join("missing.any"))) is None
+
+
+def test_result_cache_keys(model):
+    cache = ResultCache(str(model.join("cache")))
+    task = Task(folder=str(model), macro=['load "model.main.any"', "run"])
+    key = cache.key(task, "8.0.0")
+    assert key == cache.key(task, "8.0.0")
+    assert key != cache.key(task, "8.1.0")
+    other_task = Task(folder=str(model), macro=['load "model.main.any"', "exit"])
+    assert key != cache.key(other_task, "8.0.0")
+    assert key != cache.key(task, "8.0.0", {"keep": ["Main.*"]})
+    # Tasks which does not load a model can not be cached
+    assert cache.key(Task(folder=str(model), macro=["run"])) is None
+    # Data files used by the model are part of the key when listed
+    model.join("trial.c3d").write("data")
+    data_cache = ResultCache(str(model.join("cache")), dependencies=["*.c3d"])
+    data_key = data_cache.key(task, "8.0.0")
+    assert data_key != key
+    model.join("trial.c3d").write("other data")
+    assert data_cache.key(task, "8.0.0") != data_key
+    assert cache.key(task, "8.0.0") == key
+    # Models with includes which can not be resolved are not cached
+    model.join("model.main.any").write('#include "<ANYBODY_PATH_AMMR>/Body.any"')
+    assert cache.key(task, "8.0.0") is None
+
+
+def test_result_cache_options(model):
+    anybodycon = model.join("anybodycon.exe")
+    anybodycon.write("")
+
+    def options(**kwargs):
+        app = AnyPyProcess(
+            anybodycon_path=str(anybodycon), persistent_wineserver=False, **kwargs
+        )
+        return app._result_cache_options()
+
+    assert options() is None
+    assert options(ignore_errors=["OBJ1"]) == {"ignore_errors": ["OBJ1"]}
+    assert options(warnings_to_include=["OBJ2"], fatal_warnings=True) == {
+        "warnings_to_include": ["OBJ2"],
+        "fatal_warnings": True,
+    }
+    assert options(keep="Main.*") == {"keep": ["Main.*"]}
+
+
+def test_result_cache_lru_eviction(tmpdir):
+    cache = ResultCache(str(tmpdir), max_size=10_000)
+    payload = "x" * 3000
+    for key in ["aa01", "bb02", "cc03"]:
+        cache.put(key, {"output": payload})
+    assert cache.get("aa01") == {"output": payload}
+    # Adding a fourth entry evicts the least recently used entry
+    old = time.time() - 100
+    os.utime(cache._path("bb02"), (old, old))
+    cache.put("dd04", {"output": payload})
+    assert cache.get("bb02") is None
+    assert cache.get("aa01") is not None
+    assert cache.size <= 10_000
+    cache.clear()
+    assert cache.get("aa01") is None
+    assert cache.size == 0
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import sys
+import textwrap
+
+import pytest
+
+from anypytools.macroutils import Dump, SetValue
+from anypytools.session import AnyBodySession, AnyBodySessionError, AnyBodySessionPool
+
+FAKE_CONSOLE = textwrap.dedent("""
+    import re, sys
+    values = {}
+    print("AnyBody Console Application (fake)", flush=True)
+    for line in sys.stdin:
+        line = line.strip()
+        print("#### Macro command > " + line)
+        if line == "exit":
+            break
+        if line == "crash":
+            sys.exit(3)
+        m = re.match(r'classoperation (\\S+) "Set Value" --value="(.*)"', line)
+        if m:
+            values[m.group(1)] = m.group(2)
+        m = re.match(r'classoperation (\\S+) "Dump"', line)
+        if m:
+            print(f"{m.group(1)} = {values.get(m.group(1), '0.0')};")
+        m = re.match(r'print "(.*)"', line)
+        if m:
+            print(m.group(1))
+        if line.startswith("load"):
+            values = {}
+            print("Loading model " + str(id(values)))
+        if line.startswith("fail"):
+            print("ERROR : Something failed")
+        sys.stdout.flush()
+    """)
+
+
+class FakeSession(AnyBodySession):
+    def _command(self):
+        return [sys.executable, str(self.anybodycon_path)]
+
+
+@pytest.fixture()
+def fake_console(tmp_path):
+    console = tmp_path / "fakecon.py"
+    console.write_text(FAKE_CONSOLE)
+    yield console
+
+
+def test_session_run(fake_console, tmp_path):
+    logfile = tmp_path / "session.log"
+    with FakeSession(fake_console, folder=tmp_path, logfile=logfile) as session:
+        for value in [1.5, 2.5]:
+            out = session.run([SetValue("Main.Var", value), Dump("Main.Var")])
+            assert out["Main.Var"] == value
+            assert "ERROR" not in out
+        out = session.run("fail")
+        assert "ERROR" in out
+        # The session continues after errors
+        assert session.run(Dump("Main.Var"))["Main.Var"] == 2.5
+        assert session.number_of_runs == 4
+    assert not session.is_alive
+    assert "Main.Var = 1.5;" in logfile.read_text()
+
+
+def test_session_process_exit(fake_console, tmp_path):
+    session = FakeSession(fake_console, folder=tmp_path)
+    with pytest.raises(AnyBodySessionError):
+        session.run("crash")
+    session.close()
+
+
+class FakeSessionPool(AnyBodySessionPool):
+    session_class = FakeSession
+
+
+def test_session_pool(fake_console, tmp_path):
+    pool = FakeSessionPool(
+        max_sessions=2,
+        max_runs_per_session=3,
+        reset="reload",
+        anybodycon_path=fake_console,
+    )
+    macro = ['load "model.any"', 'classoperation Main.Var "Set Value" --value="1"']
+    with pool:
+        lines = pool.run(tmp_path, macro + ['classoperation Main.Var "Dump"', "exit"])
+        assert "Main.Var = 1;" in lines
+        assert pool._n_sessions == 1
+        # The reset reloads the model, so the previous value is gone
+        lines = pool.run(
+            tmp_path, ['load "model.any"', 'classoperation Main.Var "Dump"']
+        )
+        assert "Main.Var = 0.0;" in lines
+        assert pool._n_sessions == 1
+        # A different load command uses a new session
+        pool.run(tmp_path, ['load "other.any"'])
+        assert pool._n_sessions == 2
+        # Sessions with errors are recycled
+        pool.run(tmp_path, ['load "model.any"', "fail"])
+        assert pool._n_sessions == 1
+        with pytest.raises(ValueError):
+            pool.run(tmp_path, ['classoperation Main.Var "Dump"'])
+    assert pool._n_sessions == 0
+
+
+@pytest.mark.parametrize(
+    "option", [{"stall_timeout": 60}, {"abort_on_error": True}, {"wine_prefixes": 2}]
+)
+def test_unsupported_options_with_warm_sessions(fake_console, option):
+    from anypytools.abcutils import AnyPyProcess
+
+    if "wine_prefixes" in option and sys.platform.startswith("win"):
+        pytest.skip("Wine prefixes are only used on Linux")
+    with pytest.raises(ValueError, match="warm_sessions"):
+        AnyPyProcess(anybodycon_path=fake_console, warm_sessions=True, **option)
+
+
+def test_session_pool_respects_max_sessions(fake_console, tmp_path):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    lock = threading.Lock()
+    live = []
+    max_live = []
+
+    class CountingSession(FakeSession):
+        def start(self, timeout=120):
+            with lock:
+                live.append(self)
+                max_live.append(len(live))
+            super().start(timeout)
+
+        def close(self, timeout=10, force=False):
+            with lock:
+                if self in live:
+                    live.remove(self)
+            super().close(timeout, force)
+
+    class CountingPool(AnyBodySessionPool):
+        session_class = CountingSession
+
+    pool = CountingPool(max_sessions=2, anybodycon_path=fake_console)
+    macros = [[f'load "model{i % 3}.any"', 'print "done"'] for i in range(12)]
+    with pool, ThreadPoolExecutor(6) as executor:
+        results = list(executor.map(lambda m: pool.run(tmp_path, m), macros))
+    assert all("done" in lines for lines in results)
+    assert max(max_live) <= 2
+    assert pool._n_sessions == 0
@@ -4,14 +4,22 @@ Created on Sun Jul 06 19:09:58 2014
 
 @author: Morten
 """
+import multiprocessing
 import os
+import random
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import pytest
 
-from anypytools.tools import (AnyPyProcessOutput, AnyPyProcessOutputList,
-                              _parse_data, array2anyscript, define2str,
+from anypytools.tools import (AnyBodyConLogParser, AnyPyProcessOutput,
+                              AnyPyProcessOutputList, _load_parsed_logfile,
+                              _parse_anybodycon_output_regex, _parse_data,
+                              _parse_data_literal, _parse_logfile_in_worker,
+                              _substring_pattern,
+                              array2anyscript, define2str,
                               get_anybodycon_path, parse_anybodycon_output,
                               path2str)
 
@@ -168,6 +176,34 @@ def test_parse_anybodydata_arrays(str_val, expected, expected_dtype):
     assert np.isclose(data_np, expected, equal_nan=True).all()
 
 
+@pytest.mark.parametrize(
+    "str_val",
+    [
+        "{1.0, 2.0}",
+        "{{1, 2}, {3, 4}, {5, 6}}",
+        "{{{1.0, nan}, {-inf, 2e-3}}, {{-nan, 1.0E+02}, {-3, inf}}}",
+        "{{1.5}}",
+        "{}",
+        "{{}, {}}",
+        "{...}",
+        '{"a", "b"}',
+        "{Main.Model.Var, 1.0}",
+    ],
+)
+def test_parse_anybodydata_fast_path_matches_literal_eval(str_val):
+    out = _parse_data(str_val)
+    expected = _parse_data_literal(str_val)
+    if expected is None:
+        assert out is None
+        return
+    assert out.dtype == expected.dtype
+    assert out.shape == expected.shape
+    if out.dtype.kind in "fi":
+        assert np.array_equal(out, expected, equal_nan=True)
+    else:
+        assert (out == expected).all()
+
+
 @pytest.mark.parametrize(
     "str_val, expected, expected_type",
     [
@@ -234,6 +270,198 @@ def test_parse_anybodycon_output():
     assert np.array_equal(data["array"], np.array([1, 2, 3]))
 
 
+LOG_LINES = [
+    '#### Macro command > classoperation Main.Study.Output.x "Dump"',
+    '#### Macro command > classoperation Main.SubFolder "Dump"',
+    '#### Macro command > classoperation Global.pi "Dump"',
+    '#### Macro command > classoperation Main.x "Dump All"',
+    "#### Macro command > print Main.y",
+    '#### Macro command > load "main.any"',
+    "#### Macro command >",
+    "#### ANYPYTOOLS RENAME OUTPUT: Renamed x",
+    '#### Macro command > print "#### ANYPYTOOLS RENAME OUTPUT: Renamed x"',
+    "Main.Study.Output.x = {1.0, 2.0, nan};",
+    "Main.SubFolder = {...};",
+    "Main.SubFolder.Sub = 42.0;",
+    "Main.y = {{1, 2}, {3, 4}};",
+    "pi = 3.14;",
+    "hello = 'world';",
+    'Main.str = "a;b";',
+    "Main.a = 1; trailing; text",
+    "Main.multi = {1.0,",
+    "  2.0, 3.0};",
+    "  4.0;",
+    "  5.0",
+    " x = 1;",
+    "Main.bad = {1,,2};",
+    "Main.no_space =",
+    "",
+    " ",
+    "   ",
+    "ERROR(OBJ1): file.any(12): Main.x : Error message",
+    "error : something",
+    "Model loading skipped",
+    "WARNING(OBJ.MCH.KIN6): Close to singular position",
+    "Warning : something else",
+    "NOTICE(OBJ2): note",
+    "Elapsed Time : 0.015000",
+]
+
+
+def _random_logs(n, seed=0):
+    rng = random.Random(seed)
+    for _ in range(n):
+        lines = [rng.choice(LOG_LINES) for _ in range(rng.randint(0, 20))]
+        yield "\n".join(lines) + rng.choice(["", "\n"])
+
+
+def _assert_same_output(out, expected):
+    assert list(out) == list(expected)
+    for key, value in expected.items():
+        if isinstance(value, np.ndarray):
+            assert out[key].dtype == value.dtype
+            assert np.array_equal(out[key], value, equal_nan=value.dtype.kind == "f")
+        else:
+            assert out[key] == value
+
+
+def test_parse_anybodycon_output_matches_regex_parser():
+    raw = (Path(__file__).parent / "data" / "anybodycon_output.txt").read_text()
+    logs = [raw] + list(_random_logs(2000))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for raw in logs:
+            for fatal_warnings in [False, True]:
+                kwargs = dict(
+                    errors_to_ignore=["OBJ1"],
+                    warnings_to_include=["OBJ.MCH", "note"],
+                    fatal_warnings=fatal_warnings,
+                )
+                _assert_same_output(
+                    parse_anybodycon_output(raw, **kwargs),
+                    _parse_anybodycon_output_regex(raw, **kwargs),
+                )
+
+
+def test_parse_anybodycon_output_from_logfile(tmp_path):
+    raw = (Path(__file__).parent / "data" / "anybodycon_output.txt").read_text()
+    raw += "\nERROR : Non UTF-8 byte \udcff\n"
+    logfile = tmp_path / "log.txt"
+    with open(logfile, "w", encoding="utf8", errors="surrogateescape", newline="\r\n") as fh:
+        fh.write(raw)
+    expected = parse_anybodycon_output(logfile.read_text(errors="backslashreplace"))
+    _assert_same_output(parse_anybodycon_output(logfile), expected)
+    assert expected["ERROR"] == ["ERROR : Non UTF-8 byte \\xff"]
+
+    logfile.write_bytes(b"")
+    assert parse_anybodycon_output(logfile) == {}
+
+
+def test_log_parser_accepts_chunks():
+    raw = (Path(__file__).parent / "data" / "anybodycon_output.txt").read_text()
+    logs = [raw] + list(_random_logs(200, seed=1))
+    rng = random.Random(2)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for raw in logs:
+            parser = AnyBodyConLogParser(warnings_to_include=["OBJ"])
+            pos = 0
+            while pos < len(raw):
+                size = rng.randint(1, 30)
+                parser.feed_text(raw[pos : pos + size])
+                pos += size
+            _assert_same_output(
+                parser.finish(),
+                parse_anybodycon_output(raw, warnings_to_include=["OBJ"]),
+            )
+
+
+@pytest.mark.parametrize("compress_size", [2**16, 10])
+def test_parse_anybodycon_output_lazy(monkeypatch, compress_size):
+    import collections
+    import pickle
+
+    from anypytools.tools import _LazyValue
+
+    monkeypatch.setattr(_LazyValue, "compress_size", compress_size)
+    raw = (Path(__file__).parent / "data" / "anybodycon_output.txt").read_text()
+    expected = parse_anybodycon_output(raw)
+    lazy = parse_anybodycon_output(raw, lazy=True)
+
+    def unparsed(output):
+        return [
+            k for k, v in collections.OrderedDict.items(output)
+            if not isinstance(v, (str, int, float, np.ndarray))
+        ]
+
+    assert unparsed(lazy) == ["Main.MyOutput2", "Main.SomeMatrix", "array"]
+    # Lazy values stay unparsed when pickled
+    lazy = pickle.loads(pickle.dumps(lazy))
+    assert len(unparsed(lazy)) == 3
+
+    assert lazy["SomeMatrix"].shape == (3, 3)
+    assert unparsed(lazy) == ["Main.MyOutput2", "array"]
+    assert np.array_equal(lazy.get("array"), expected["array"])
+
+    outputs = AnyPyProcessOutputList(
+        [parse_anybodycon_output(raw, lazy=True) for _ in range(3)]
+    )
+    assert outputs["Main.MyOutput2"].shape == (3, 3)
+
+    _assert_same_output(lazy, expected)
+    assert unparsed(lazy) == []
+
+
+def test_parse_anybodycon_output_keep():
+    raw = (Path(__file__).parent / "data" / "anybodycon_output.txt").read_text()
+    output = parse_anybodycon_output(
+        raw, keep=["Main.My*", "Renamed with spaces", "array"]
+    )
+    assert list(output) == [
+        "Main.MyOutput",
+        "Main.MyOutput2",
+        "Renamed with spaces",
+        "array",
+    ]
+    assert parse_anybodycon_output(raw, keep=[]) == {}
+
+    parser = AnyBodyConLogParser(keep="Main.b")
+    lines = ["Main.a = {1,", "  2};", "Main.b = 1.0;", "pi = 2.0;"]
+    parser.feed(lines)
+    assert list(parser.finish()) == ["Main.b"]
+    assert parser.skipped_lines == [(0, 2), (3, 4)]
+
+
+def test_parse_logfile_in_process_pool(tmp_path):
+    raw = (Path(__file__).parent / "data" / "anybodycon_output.txt").read_text()
+    logfile = tmp_path / "log.txt"
+    logfile.write_text(raw)
+    options = dict(warnings_to_include=["OBJ"], keep=["Main.*", "array"])
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=context) as pool:
+        future = pool.submit(_parse_logfile_in_worker, str(logfile), options)
+        output, skipped_lines = _load_parsed_logfile(*future.result())
+    parser = AnyBodyConLogParser(**options)
+    parser.feed(raw.split("\n"))
+    _assert_same_output(output, parser.finish())
+    assert skipped_lines == parser.skipped_lines
+    assert output["Main.SomeMatrix"].flags.writeable
+
+
+def test_substring_pattern_matches_any_substring():
+    rng = random.Random(0)
+    for _ in range(500):
+        substrings = tuple(
+            "".join(rng.choice("ab(.*") for _ in range(rng.randint(0, 4)))
+            for _ in range(rng.randint(0, 6))
+        )
+        pattern = _substring_pattern(substrings)
+        for _ in range(20):
+            line = "".join(rng.choice("ab(.*c") for _ in range(rng.randint(0, 12)))
+            expected = any(substring in line for substring in substrings)
+            assert bool(pattern.search(line)) == expected
+
+
 if __name__ == "__main__":
     os.chdir(Path(__file__).parent)
     pytest.main([str("test_tools.py::test_AnyPyProcessOutputList_to_dataframe")])
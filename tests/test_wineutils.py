@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import os
+from pathlib import Path
+
+import pytest
+
+from anypytools import wineutils
+from anypytools.wineutils import WinePathTranslator, WinePrefixPool, WineServer
+
+
+@pytest.fixture()
+def template_prefix(tmp_path):
+    template = tmp_path / "wine"
+    (template / "drive_c").mkdir(parents=True)
+    (template / "dosdevices").mkdir()
+    os.symlink("../drive_c", template / "dosdevices" / "c:")
+    os.symlink("/", template / "dosdevices" / "z:")
+    yield template
+
+
+@pytest.fixture()
+def wine_commands(monkeypatch):
+    """Record the wine commands instead of running them."""
+    commands = []
+
+    def run(cmd, env=None, **kwargs):
+        commands.append((cmd, env["WINEPREFIX"]))
+
+    monkeypatch.setattr(wineutils.shutil, "which", lambda name: "/usr/bin/" + name)
+    monkeypatch.setattr(wineutils.subprocess, "run", run)
+    yield commands
+
+
+def test_wineserver_start_and_reuse(wine_commands):
+    server = WineServer(prefix="/tmp/prefix", persistence=30)
+    assert server.start()
+    assert wine_commands == [
+        (["wineserver", "--persistent=30"], "/tmp/prefix"),
+        (["wine", "cmd", "/c", "exit"], "/tmp/prefix"),
+    ]
+    # A started server is reused
+    assert server.start()
+    assert len(wine_commands) == 2
+
+
+def test_wineserver_stop_does_not_kill_the_server(wine_commands):
+    with WineServer(prefix="/tmp/prefix") as server:
+        assert server.ready
+    assert not server.ready
+    # The server exits by itself after the persistence delay
+    assert [cmd[0][0] for cmd in wine_commands] == ["wineserver", "wine"]
+    assert server.start()
+    assert len(wine_commands) == 4
+
+
+def test_wineserver_without_wine(monkeypatch):
+    monkeypatch.setattr(wineutils.shutil, "which", lambda name: None)
+    assert not WineServer().start()
+
+
+def test_prefix_pool_round_robin(template_prefix):
+    pool = WinePrefixPool(3, template=template_prefix)
+    assert len(pool) == 3
+    assert pool[0] == template_prefix.with_name("wine_anypytools_0")
+    assert pool[4] == pool[1]
+    assert pool.env(5, {})["WINEPREFIX"] == str(pool[2])
+
+
+def test_prefix_pool_create(template_prefix):
+    pool = WinePrefixPool(2, template=template_prefix)
+    pool.create()
+    for prefix in pool.prefixes:
+        assert (prefix / "drive_c").is_dir()
+        assert os.readlink(prefix / "dosdevices" / "c:") == "../drive_c"
+
+
+def test_prefix_pool_rebase(template_prefix):
+    pool = WinePrefixPool([template_prefix.with_name("other")], template_prefix)
+    exe = template_prefix / "drive_c" / "AnyBodyCon.exe"
+    assert pool.rebase(exe, 0) == template_prefix.with_name("other") / exe.relative_to(
+        template_prefix
+    )
+    assert pool.rebase(Path("/tmp/model.any"), 0) == Path("/tmp/model.any")
+
+
+def test_path_translator_to_windows(template_prefix, tmp_path):
+    translator = WinePathTranslator(template_prefix)
+    model = tmp_path / "models" / "main.any"
+    expected = "Z:" + str(model).replace("/", "\\")
+    assert translator.to_windows(model) == expected
+    program = template_prefix / "drive_c" / "Program Files" / "AnyBodyCon.exe"
+    assert translator.to_windows(program) == "C:\\Program Files\\AnyBodyCon.exe"
+    assert translator.to_windows("/") == "Z:\\"
+
+
+def test_path_translator_to_unix(template_prefix):
+    translator = WinePathTranslator(template_prefix)
+    drive_c = template_prefix / "drive_c"
+    (drive_c / "Program Files").mkdir()
+    assert translator.to_unix("C:\\Program Files\\new.txt") == str(
+        drive_c / "Program Files" / "new.txt"
+    )
+    # Windows paths are case insensitive
+    assert translator.to_unix("c:/PROGRAM FILES") == str(drive_c / "Program Files")
+    # Unknown drives and UNC paths are not translated
+    assert translator.to_unix("Q:\\data") is None
+    assert translator.to_unix("\\\\server\\share") is None
+
+
+def test_path_translator_ambiguous_case(template_prefix):
+    drive_c = template_prefix / "drive_c"
+    (drive_c / "data").mkdir()
+    (drive_c / "DATA").mkdir()
+    translator = WinePathTranslator(template_prefix)
+    assert translator.to_unix("C:\\Data") is None